@@ -2,15 +2,53 @@
 # this repository contains the full copyright notices and license terms.
 
 from trytond.pool import Pool
+from . import company
+from . import configuration
+from . import holiday
+from . import instrumentation
+from . import ir
+from . import project
 from . import user_timesheet
+from . import user_timesheet_day
+from . import user_timesheet_project_hours
 from . import user_timesheet_record
+from . import user_timesheet_record_edit
+from . import user_timesheet_record_export
+from . import user_timesheet_record_import
+from . import user_timesheet_record_sync
+from . import user_timesheet_record_tombstone
+from . import user_timesheet_summary
+from . import working_day
 
 def register():
     Pool.register(
+        company.Company,
+        configuration.Configuration,
+        holiday.Holiday,
+        instrumentation.Instrumentation,
+        ir.Rule,
+        ir.Cron,
         user_timesheet.UserTimesheet,
+        working_day.WorkingDay,
         user_timesheet_record.UserTimesheetRecord,
+        user_timesheet_day.UserTimesheetDay,
+        user_timesheet_record_sync.UserTimesheetRecordSync,
+        user_timesheet_record_tombstone.UserTimesheetRecordTombstone,
+        user_timesheet_summary.UserTimesheetSummary,
+        user_timesheet_project_hours.ProjectHours,
+        user_timesheet_project_hours.ProjectHoursContext,
+        user_timesheet_record_edit.EditStart,
+        user_timesheet_record_export.ExportStart,
+        user_timesheet_record_export.ExportResult,
+        user_timesheet_record_import.ImportStart,
         module='afx_timesheet', type_='model')
-    # Pool.register(
-    #     module='afx_timesheet', type_='wizard')
+    Pool.register(
+        user_timesheet_record_edit.Edit,
+        user_timesheet_record_export.Export,
+        user_timesheet_record_import.Import,
+        module='afx_timesheet', type_='wizard')
+    Pool.register(
+        project.Project,
+        module='afx_timesheet', type_='model', depends=['afx_project'])
     # Pool.register(
     #     module='afx_timesheet', type_='report')
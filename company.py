@@ -0,0 +1,26 @@
+from trytond.pool import Pool, PoolMeta
+
+
+class Company(metaclass=PoolMeta):
+    __name__ = 'company.company'
+
+    @classmethod
+    def write(cls, *args):
+        """
+        Apply the change of the working time to the working calendar of the
+        open months of the companies.
+        """
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+        WorkingDay = pool.get('afx.timesheet.working_day')
+
+        actions = iter(args)
+        company_ids = set()
+        for companies, values in zip(actions, actions):
+            if values.keys() & {'hours_per_work_day', 'hours_per_work_week'}:
+                company_ids.update(c.id for c in companies)
+
+        super().write(*args)
+        UserTimesheet._working_calendar_cache.clear()
+        if company_ids:
+            WorkingDay.refreeze(WorkingDay.get_open_months(company_ids))
@@ -0,0 +1,117 @@
+from trytond.model import ModelSingleton, ModelSQL, ModelView, fields
+from trytond.pool import Pool
+from trytond.cache import Cache
+
+
+class Configuration(ModelSingleton, ModelSQL, ModelView):
+    "Timesheet Configuration"
+    __name__ = 'afx.timesheet.configuration'
+
+    project_sync_mode = fields.Selection([
+            ('immediate', "Immediate"),
+            ('deferred', "Deferred"),
+            ], "Project Sync Mode", required=True,
+        help="Immediate: project members and tasks are synchronised when "
+        "the timesheet records are saved.\n"
+        "Deferred: the records are queued and synchronised by a "
+        "scheduled task.")
+    sparse_records = fields.Boolean(
+        "Sparse Records",
+        help="Store only the days of new timesheets which differ from the "
+        "default day.\n"
+        "The other days are filled in with the default values when read and "
+        "stored on their first change.")
+
+    max_daily_hours = fields.Float(
+        "Max Daily Hours", digits=(16, 2), required=True,
+        domain=[
+            ('max_daily_hours', '>=', 0),
+            ('max_daily_hours', '<=', 24),
+            ],
+        help="The maximum total hours of an employee per day.\n"
+        "0 disables the check.")
+    archive_after_months = fields.Integer(
+        "Archive After Months", required=True,
+        domain=[('archive_after_months', '>=', 0)],
+        help="The number of months after which the timesheets are archived "
+        "by the scheduled task.\n"
+        "The archived timesheets are read-only and excluded from the "
+        "default searches and reports. 0 disables the archiving.")
+    instrumentation_sample_rate = fields.Float(
+        "Instrumentation Sample Rate", digits=(16, 4), required=True,
+        domain=[
+            ('instrumentation_sample_rate', '>=', 0),
+            ('instrumentation_sample_rate', '<=', 1),
+            ],
+        help="The share of the calls of the timesheet hot paths whose time, "
+        "SQL statements and rows are measured.\n"
+        "0 disables the measures, 1 measures every call.")
+    instrumentation_retention_days = fields.Integer(
+        "Instrumentation Retention Days", required=True,
+        domain=[('instrumentation_retention_days', '>=', 0)],
+        help="The number of days the measures are kept before being "
+        "deleted by the scheduled task.\n"
+        "0 keeps them forever.")
+
+    _instrumentation_cache = Cache(
+        'afx.timesheet.configuration.instrumentation', context=False)
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        cls._buttons.update({
+                'provision_timesheets': {},
+                })
+
+    # ------- DEFAULT VALUES --------
+    @classmethod
+    def default_project_sync_mode(cls):
+        return 'immediate'
+
+    @classmethod
+    def default_sparse_records(cls):
+        return False
+
+    @classmethod
+    def default_max_daily_hours(cls):
+        return 24.0
+
+    @classmethod
+    def default_archive_after_months(cls):
+        return 12
+
+    @classmethod
+    def default_instrumentation_sample_rate(cls):
+        return 0.0
+
+    @classmethod
+    def default_instrumentation_retention_days(cls):
+        return 30
+
+    # -------- OVERRIDE METHODS --------
+    @classmethod
+    def write(cls, *args):
+        super().write(*args)
+        cls._instrumentation_cache.clear()
+
+    @classmethod
+    def get_instrumentation_sample_rate(cls):
+        """
+        Return the cached instrumentation sample rate.
+        """
+        rate = cls._instrumentation_cache.get(None, -1)
+        if rate == -1:
+            rate = cls(1).instrumentation_sample_rate or 0.0
+            cls._instrumentation_cache.set(None, rate)
+        return rate
+
+    # -------- BUTTON METHODS --------
+    @classmethod
+    @ModelView.button
+    def provision_timesheets(cls, configurations):
+        """
+        Create the next month timesheets of the employees without one.
+        """
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+        UserTimesheet.provision()
@@ -0,0 +1,66 @@
+from trytond.model import ModelSQL, ModelView, Unique, fields
+from trytond.pool import Pool
+
+
+class Holiday(ModelSQL, ModelView):
+    "Timesheet Holiday"
+    __name__ = 'afx.timesheet.holiday'
+
+    company = fields.Many2One(
+        'company.company', "Company", required=True, ondelete='CASCADE')
+    date = fields.Date("Date", required=True)
+    name = fields.Char("Name", required=True)
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        t = cls.__table__()
+        cls._sql_constraints += [
+            ('company_date_unique', Unique(t, t.company, t.date),
+                'afx_timesheet.msg_holiday_company_date_unique'),
+            ]
+        cls._order.insert(0, ('date', 'DESC'))
+
+    # ------- DEFAULT VALUES --------
+    @classmethod
+    def default_company(cls):
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+        return UserTimesheet.MAIN_COMPANY
+
+    # -------- OVERRIDE METHODS --------
+    @classmethod
+    def create(cls, vlist):
+        holidays = super().create(vlist)
+        cls._refreeze_months(cls._get_months(holidays))
+        return holidays
+
+    @classmethod
+    def write(cls, *args):
+        holidays = sum(args[::2], [])
+        months = cls._get_months(holidays)
+        super().write(*args)
+        months |= cls._get_months(cls.browse([h.id for h in holidays]))
+        cls._refreeze_months(months)
+
+    @classmethod
+    def delete(cls, holidays):
+        months = cls._get_months(holidays)
+        super().delete(holidays)
+        cls._refreeze_months(months)
+
+    @staticmethod
+    def _get_months(holidays):
+        return {(h.company.id, h.date.year, h.date.month) for h in holidays}
+
+    @staticmethod
+    def _refreeze_months(months):
+        """
+        Apply the change of the holidays to the working calendar of their
+        months.
+        """
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+        WorkingDay = pool.get('afx.timesheet.working_day')
+        UserTimesheet._working_calendar_cache.clear()
+        WorkingDay.refreeze(months)
@@ -0,0 +1,227 @@
+from trytond.model import ModelSQL, ModelView, fields
+from trytond.pool import Pool
+from trytond.transaction import Transaction
+from trytond import backend
+from collections import defaultdict
+import datetime
+import functools
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class Instrumentation(ModelSQL, ModelView):
+    "Timesheet Instrumentation"
+    __name__ = 'afx.timesheet.instrumentation'
+
+    method = fields.Char("Method", readonly=True)
+    duration = fields.Float(
+        "Duration", digits=(16, 4), readonly=True, help="In seconds.")
+    queries = fields.Integer(
+        "Queries", readonly=True,
+        help="Number of SQL statements executed by the call.")
+    rows = fields.Integer(
+        "Rows", readonly=True, help="Number of rows handled by the call.")
+    user = fields.Many2One('res.user', "User", readonly=True)
+
+    # Hardcoded
+    FLUSH_SIZE = 100
+    FLUSH_INTERVAL = 60  # seconds
+    _buffers = defaultdict(list)
+    _flushed_at = {}
+    _buffer_lock = threading.Lock()
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        cls._order.insert(0, ('create_date', 'DESC'))
+
+    @classmethod
+    def record(cls, method, duration, queries, rows):
+        """
+        Buffer the measure of a call, the buffered measures are stored
+        together when FLUSH_SIZE measures are buffered or FLUSH_INTERVAL has
+        elapsed since the last flush.
+        """
+        transaction = Transaction()
+        database = transaction.database.name
+        now = time.monotonic()
+        with cls._buffer_lock:
+            buffer = cls._buffers[database]
+            buffer.append([
+                    method, duration, queries, rows, transaction.user,
+                    datetime.datetime.now()])
+            flushed_at = cls._flushed_at.setdefault(database, now)
+            if (len(buffer) < cls.FLUSH_SIZE
+                    and now - flushed_at < cls.FLUSH_INTERVAL):
+                return
+            measures = buffer[:]
+            buffer.clear()
+            cls._flushed_at[database] = now
+        cls._flush(measures)
+
+    @classmethod
+    def _flush(cls, measures):
+        """
+        Store the measures with one INSERT without access check.
+        They are committed apart so the measures of read-only transactions
+        are kept.
+        """
+        table = cls.__table__()
+        with Transaction().new_transaction() as transaction:
+            cursor = transaction.connection.cursor()
+            cursor.execute(*table.insert(
+                    [table.method, table.duration, table.queries, table.rows,
+                        table.user, table.create_uid, table.create_date],
+                    [[m, d, q, r, u, u, t]
+                        for m, d, q, r, u, t in measures]))
+            transaction.commit()
+
+    @classmethod
+    def purge(cls):
+        """
+        Delete the measures older than the retention period of the
+        configuration.
+        """
+        pool = Pool()
+        Configuration = pool.get('afx.timesheet.configuration')
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+
+        days = Configuration(1).instrumentation_retention_days
+        if not days:
+            return
+        cursor.execute(*table.delete(
+                where=table.create_date < (
+                    datetime.datetime.now() - datetime.timedelta(days=days))))
+
+
+class QueryCounter:
+    """
+    Count the SQL statements executed on the connection by the measured
+    calls of the current thread.
+    The PostgreSQL statements are counted by a cursor factory and the SQLite
+    statements by the trace callback of the connection. Both are only set on
+    the connection of the outermost measured call and while it runs, so the
+    other connections and the logging configuration are not changed.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._cursor_factories = {}
+
+    @property
+    def frames(self):
+        if not hasattr(self._local, 'frames'):
+            self._local.frames = []
+        return self._local.frames
+
+    def count(self):
+        for frame in self.frames:
+            frame['queries'] += 1
+
+    def trace(self, statement):
+        self.count()
+        if _sqlite_logger.isEnabledFor(logging.DEBUG):
+            _sqlite_logger.debug(statement)
+
+    def cursor_factory(self, base):
+        "Return the cursor factory counting the statements of base"
+        factory = self._cursor_factories.get(base)
+        if factory is None:
+            counter = self
+
+            class CountingCursor(base):
+                def execute(self, *args, **kwargs):
+                    counter.count()
+                    return super().execute(*args, **kwargs)
+
+            factory = self._cursor_factories[base] = CountingCursor
+        return factory
+
+    def start(self):
+        frame = {'queries': 0}
+        if not self.frames:
+            connection = Transaction().connection
+            self._local.connection = connection
+            if backend.name == 'sqlite':
+                connection.set_trace_callback(self.trace)
+            else:
+                self._local.cursor_factory = connection.cursor_factory
+                connection.cursor_factory = self.cursor_factory(
+                    connection.cursor_factory)
+        self.frames.append(frame)
+        return frame
+
+    def stop(self, frame):
+        self.frames.remove(frame)
+        if not self.frames:
+            connection = self._local.connection
+            del self._local.connection
+            if backend.name == 'sqlite':
+                # Like the backend when the connection is opened
+                connection.set_trace_callback(
+                    _sqlite_logger.debug
+                    if _sqlite_logger.isEnabledFor(logging.DEBUG) else None)
+            else:
+                connection.cursor_factory = self._local.cursor_factory
+
+
+_counter = QueryCounter()
+_sqlite_logger = logging.getLogger('trytond.backend.sqlite.database')
+
+
+def _count_rows(result, args):
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    elif isinstance(result, int):
+        # search(..., count=True)
+        return result
+    elif result is None:
+        # write(records, values, [records, values, ...])
+        return sum(len(a) for a in args[::2] if isinstance(a, (list, tuple)))
+    return 0
+
+
+def instrumented(name):
+    """
+    Measure the wall time, the SQL statements and the rows of the sampled
+    calls of the decorated classmethod.
+    The measures are logged and stored as afx.timesheet.instrumentation.
+    The sample rate is set on the configuration, calls are not measured by
+    default.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(cls, *args, **kwargs):
+            pool = Pool()
+            Configuration = pool.get('afx.timesheet.configuration')
+            rate = Configuration.get_instrumentation_sample_rate()
+            if not rate or random.random() >= rate:
+                return func(cls, *args, **kwargs)
+
+            frame = _counter.start()
+            start = time.perf_counter()
+            try:
+                result = func(cls, *args, **kwargs)
+            finally:
+                duration = time.perf_counter() - start
+                _counter.stop(frame)
+            rows = _count_rows(result, args)
+            logger.info(
+                "%s duration=%.4fs queries=%s rows=%s",
+                name, duration, frame['queries'], rows,
+                extra={'instrumentation': {
+                        'method': name,
+                        'duration': duration,
+                        'queries': frame['queries'],
+                        'rows': rows,
+                        'user': Transaction().user,
+                        }})
+            Instrumentation = pool.get('afx.timesheet.instrumentation')
+            Instrumentation.record(name, duration, frame['queries'], rows)
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,46 @@
+from trytond.pool import Pool, PoolMeta
+
+
+class Rule(metaclass=PoolMeta):
+    __name__ = 'ir.rule'
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        cls.domain.help += (
+            '\n- "employees" as list of ids from the current user')
+
+    @classmethod
+    def _get_cache_key(cls, model_names):
+        pool = Pool()
+        User = pool.get('res.user')
+        key = super()._get_cache_key(model_names)
+        return (*key, User.get_employees())
+
+    @classmethod
+    def _get_context(cls, model_name):
+        pool = Pool()
+        User = pool.get('res.user')
+        context = super()._get_context(model_name)
+        context['employees'] = User.get_employees()
+        return context
+
+
+class Cron(metaclass=PoolMeta):
+    __name__ = 'ir.cron'
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        cls.method.selection.extend([
+                ('afx.user.timesheet.record.sync|process',
+                    "Process Timesheet Project Sync Queue"),
+                ('afx.user.timesheet|provision',
+                    "Provision Next Month Timesheets"),
+                ('afx.user.timesheet|archive',
+                    "Archive Old Timesheets"),
+                ('afx.user.timesheet.record.tombstone|purge',
+                    "Purge Timesheet Record Tombstones"),
+                ('afx.timesheet.instrumentation|purge',
+                    "Purge Timesheet Instrumentation"),
+                ])
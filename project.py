@@ -0,0 +1,49 @@
+from trytond.pool import Pool, PoolMeta
+from trytond.transaction import Transaction
+from trytond.tools import reduce_ids
+from sql import Literal
+from sql.functions import CurrentTimestamp
+
+
+class Project(metaclass=PoolMeta):
+    __name__ = 'afx.project'
+
+    @classmethod
+    def write(cls, *args):
+        """
+        Propagate the new S/O Number of the projects to the records of their
+        open timesheets with one UPDATE.
+        The closed and archived timesheets keep the S/O Number of their month.
+        """
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+        ProjectHours = pool.get('afx.user.timesheet.project_hours')
+
+        actions = iter(args)
+        project_ids = []
+        for projects, values in zip(actions, actions):
+            if 'so_no' in values:
+                project_ids.extend(p.id for p in projects)
+
+        super().write(*args)
+
+        if project_ids:
+            record = UserTimesheetRecord.__table__()
+            project = cls.__table__()
+            timesheet = UserTimesheet.__table__()
+            transaction = Transaction()
+            cursor = transaction.connection.cursor()
+            cursor.execute(*record.update(
+                    [record.so_no, record.write_uid, record.write_date],
+                    [project.select(
+                            project.so_no,
+                            where=project.id == record.project),
+                        transaction.user, CurrentTimestamp()],
+                    where=reduce_ids(record.project, project_ids)
+                    & record.timesheet.in_(timesheet.select(
+                            timesheet.id,
+                            where=(timesheet.active == Literal(True))
+                            & (timesheet.state != 'closed')))))
+            # The closed months are grouped by S/O Number
+            ProjectHours._month_cache.clear()
@@ -0,0 +1,226 @@
+# This file is part of Tryton.  The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+"""
+Benchmark of the hot paths of the timesheet module.
+
+It seeds BENCHMARK_EMPLOYEES employees with BENCHMARK_MONTHS months of
+timesheets and measures the latency and the number of SQL statements of each
+operation. The test fails when a call of an operation executes more
+statements than its budget, which does not depend on the number of rows, so
+a regression to per-row queries is caught by CI.
+The report is written as JSON to BENCHMARK_OUTPUT when it is set, so the
+latencies can be compared between CI runs. Larger runs are done with e.g.:
+
+    BENCHMARK_EMPLOYEES=200 BENCHMARK_MONTHS=3 \\
+        BENCHMARK_OUTPUT=benchmark.json \\
+        python -m unittest tests.test_benchmark
+"""
+import calendar
+import datetime
+import json
+import math
+import logging
+import os
+import time
+import unittest
+from collections import defaultdict
+from contextlib import contextmanager
+
+from trytond.modules.afx_timesheet.tests.tools import EXTRAS
+from trytond.modules.company.tests import create_company, create_employee
+from trytond.pool import Pool
+from trytond.tests.test_tryton import (
+    activate_module, drop_db, with_transaction)
+from trytond.transaction import Transaction
+
+EMPLOYEES = int(os.environ.get('BENCHMARK_EMPLOYEES', 10))
+MONTHS = int(os.environ.get('BENCHMARK_MONTHS', 2))
+OUTPUT = os.environ.get('BENCHMARK_OUTPUT')
+
+# The maximum number of SQL statements of each operation as a fixed number
+# and a number per slice of IN_MAX rows of the database.
+# The operations work on batches so the budgets do not depend on the number of
+# employees nor of months as long as their rows fit in the same slices.
+QUERY_BUDGETS = {
+    'afx.user.timesheet.create': (20, 6),
+    'afx.user.timesheet.search': (2, 0),
+    'afx.user.timesheet.record.write (month)': (18, 6),
+    'afx.user.timesheet.record.write (all)': (8, 10),
+    }
+
+
+class QueryCounter(logging.Handler):
+    """
+    Count the SQL statements logged by the database backends.
+    Without sequence, the database backend inserts the created rows one by
+    one, so these INSERT statements of a single row are not counted.
+    """
+
+    loggers = [
+        'trytond.backend.postgresql.database',
+        'trytond.backend.sqlite.database',
+        ]
+
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.count = 0
+        self.row_inserts = True
+        self._saved = {}
+
+    def emit(self, record):
+        if not self.row_inserts:
+            statement = record.getMessage()
+            if (statement.startswith('INSERT INTO')
+                    and ' VALUES ' in statement
+                    and '), (' not in statement):
+                return
+        self.count += 1
+
+    def install(self):
+        for name in self.loggers:
+            backend_logger = logging.getLogger(name)
+            self._saved[name] = (
+                backend_logger.level, backend_logger.propagate)
+            backend_logger.setLevel(logging.DEBUG)
+            backend_logger.propagate = False
+            backend_logger.addHandler(self)
+
+    def uninstall(self):
+        for name, (level, propagate) in self._saved.items():
+            backend_logger = logging.getLogger(name)
+            backend_logger.removeHandler(self)
+            backend_logger.setLevel(level)
+            backend_logger.propagate = propagate
+        self._saved.clear()
+
+
+class AfxTimesheetBenchmark(unittest.TestCase):
+    "Benchmark Afx Timesheet module"
+    module = 'afx_timesheet'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # The SQLite trace is only installed on new connections
+        cls.counter = QueryCounter()
+        cls.counter.install()
+        drop_db()
+        activate_module([cls.module] + EXTRAS)
+        cls.results = defaultdict(lambda: {
+                'calls': 0, 'rows': 0, 'seconds': 0.0, 'queries': 0,
+                'budget': 0})
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        drop_db()
+        cls.counter.uninstall()
+        report = {
+            'employees': EMPLOYEES,
+            'months': MONTHS,
+            'operations': dict(cls.results),
+            }
+        if OUTPUT:
+            with open(OUTPUT, 'w') as file:
+                json.dump(report, file, indent=2, sort_keys=True)
+
+    @contextmanager
+    def measure(self, name, rows=1):
+        "Measure the latency and the SQL statements of the block on rows"
+        result = self.results[name]
+        fixed, per_slice = QUERY_BUDGETS[name]
+        slices = math.ceil(rows / Transaction().database.IN_MAX)
+        queries = self.counter.count
+        start = time.perf_counter()
+        yield
+        result['seconds'] += time.perf_counter() - start
+        result['queries'] += self.counter.count - queries
+        result['calls'] += 1
+        result['rows'] += rows
+        result['budget'] += fixed + per_slice * slices
+
+    def seed(self):
+        "Create the company, the employees and a project"
+        pool = Pool()
+        Project = pool.get('afx.project')
+        company = create_company()
+        employees = [
+            create_employee(company, name=f"Employee {i}")
+            for i in range(EMPLOYEES)]
+        project, = Project.create([{'name': "Project", 'so_no': 'SO001'}])
+        return company, employees, project
+
+    @staticmethod
+    def months():
+        "Return the last months which can be selected on a timesheet"
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+        years = {y for y, _ in UserTimesheet._year_get()}
+        months = {m for m, _ in UserTimesheet._month_get()}
+        # The next month can be selected to provision it
+        date = (
+            datetime.date.today().replace(day=1) + datetime.timedelta(days=32))
+        result = []
+        while (len(result) < MONTHS
+                and str(date.year) in years and str(date.month) in months):
+            result.append((str(date.year), str(date.month)))
+            date = date.replace(day=1) - datetime.timedelta(days=1)
+        return result
+
+    @with_transaction()
+    def test_hot_paths(self):
+        "Benchmark the create, search and write of timesheets"
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+        company, employees, project = self.seed()
+        self.counter.row_inserts = Transaction().database.has_sequence()
+
+        timesheets = []
+        for year, month in self.months():
+            # The days of the month are an upper bound of the records
+            _, days = calendar.monthrange(int(year), int(month))
+            with self.measure(
+                    'afx.user.timesheet.create', days * len(employees)):
+                timesheets.extend(UserTimesheet.create([{
+                                'user': e.id,
+                                'year': year,
+                                'month': month,
+                                } for e in employees]))
+
+            with self.measure('afx.user.timesheet.search'):
+                UserTimesheet.search([
+                        ('year', '=', year),
+                        ('month', '=', month),
+                        ])
+        self.assertEqual(
+            UserTimesheet.search([], count=True), len(timesheets))
+
+        for timesheet in timesheets[:EMPLOYEES]:
+            records = UserTimesheetRecord.search([
+                    ('timesheet', '=', timesheet.id),
+                    ])
+            with self.measure(
+                    'afx.user.timesheet.record.write (month)', len(records)):
+                UserTimesheetRecord.write(records, {
+                        'task': 'IN_PROJECT',
+                        'project': project.id,
+                        'so_no': project.so_no,
+                        })
+
+        records = UserTimesheetRecord.search([
+                ('timesheet', 'in', [t.id for t in timesheets]),
+                ('task', '=', 'IN_PROJECT'),
+                ])
+        with self.measure(
+                'afx.user.timesheet.record.write (all)', len(records)):
+            UserTimesheetRecord.write(records, {
+                    'detail': "Benchmark",
+                    })
+
+        for name in QUERY_BUDGETS:
+            result = self.results[name]
+            with self.subTest(operation=name):
+                self.assertTrue(result['calls'])
+                self.assertLessEqual(result['queries'], result['budget'])
+
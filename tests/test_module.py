@@ -1,11 +1,1195 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
-from trytond.tests.test_tryton import ModuleTestCase
+import contextlib
+import csv
+import datetime
+import gzip
+import hashlib
+import io
+import logging
+from unittest.mock import Mock, patch
+
+from trytond.exceptions import UserError
+from trytond.modules.afx_timesheet.tests.tools import EXTRAS
+from trytond.modules.company.tests import create_company, create_employee
+from trytond.pool import Pool
+from trytond.tests.test_tryton import (
+    DB_NAME, USER, ModuleTestCase, with_transaction)
+from trytond.transaction import Transaction
 
 
 class AfxTimesheetTestCase(ModuleTestCase):
     "Test Afx Timesheet module"
     module = 'afx_timesheet'
+    extras = EXTRAS
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # The employees of the timesheets must belong to the MAIN_COMPANY
+        with Transaction().start(DB_NAME, USER) as transaction:
+            create_company()
+            transaction.commit()
+
+    def create_timesheet(self, sparse=False, **values):
+        "Create a timesheet of the current month for a new employee"
+        pool = Pool()
+        Company = pool.get('company.company')
+        Configuration = pool.get('afx.timesheet.configuration')
+        UserTimesheet = pool.get('afx.user.timesheet')
+
+        configuration = Configuration(1)
+        configuration.sparse_records = sparse
+        configuration.save()
+        company, = Company.search([])
+        today = datetime.date.today()
+        timesheet, = UserTimesheet.create([{
+                    'user': create_employee(company).id,
+                    'year': str(today.year),
+                    'month': str(today.month),
+                    **values,
+                    }])
+        return timesheet
+
+    def create_user(self, employee):
+        "Create a Timesheet User of the employee"
+        pool = Pool()
+        ModelData = pool.get('ir.model.data')
+        User = pool.get('res.user')
+        user, = User.create([{
+                    'name': "Timesheet User %s" % employee.id,
+                    'login': 'timesheet_user_%s' % employee.id,
+                    'companies': [('add', [employee.company.id])],
+                    'company': employee.company.id,
+                    'employees': [('add', [employee.id])],
+                    'employee': employee.id,
+                    'groups': [('add', [ModelData.get_id(
+                                    'afx_timesheet',
+                                    'group_user_timesheet_user')])],
+                    }])
+        return user
+
+    def get_records(self, timesheet):
+        "Return the stored records of the timesheet"
+        pool = Pool()
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+        return UserTimesheetRecord.search([
+                ('timesheet', '=', timesheet.id),
+                ], order=[('date', 'ASC'), ('id', 'ASC')])
+
+    def create_project(self):
+        "Create a project with a S/O Number"
+        pool = Pool()
+        Project = pool.get('afx.project')
+        project, = Project.create([{'name': "Project", 'so_no': 'SO001'}])
+        return project
+
+    def assertSummaryConsistent(self, timesheet):
+        "Assert that the summary is the one rebuilt from the records"
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+        UserTimesheetSummary = pool.get('afx.user.timesheet.summary')
+
+        def summary():
+            lines = UserTimesheetSummary.search([
+                    ('timesheet', '=', timesheet.id),
+                    ])
+            return (
+                sorted(
+                    (l.task, l.project and l.project.id, l.days,
+                        round(l.hours, 2))
+                    for l in lines),
+                # The total hours are updated in SQL
+                round(UserTimesheet.read(
+                        [timesheet.id], ['total_hours'])[0]['total_hours'],
+                    2))
+
+        maintained = summary()
+        UserTimesheetSummary.rebuild([timesheet.id])
+        self.assertEqual(maintained, summary())
+        return maintained
+
+    @with_transaction()
+    def test_next_month(self):
+        "Test the timesheet of the next month can be created in advance"
+        today = datetime.date.today()
+        next_month = today.replace(day=1) + datetime.timedelta(days=32)
+
+        timesheet = self.create_timesheet(
+            year=str(next_month.year), month=str(next_month.month))
+
+        self.assertTrue(self.get_records(timesheet))
+
+    @with_transaction()
+    def test_duplicate(self):
+        "Test the duplicate timesheet error names the user and the month"
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+        timesheet = self.create_timesheet()
+        values = {
+            'user': timesheet.user.id,
+            'year': timesheet.year,
+            'month': timesheet.month,
+            }
+        message = (
+            f"A timesheet for user '{timesheet.user.rec_name}' already "
+            f"exists for the year {timesheet.year} "
+            f"and month {timesheet.month}.")
+
+        with self.assertRaises(UserError) as cm:
+            UserTimesheet.create([values])
+        self.assertEqual(cm.exception.message, "Duplicate Entry")
+        self.assertEqual(cm.exception.description, message)
+
+        other = self.create_timesheet()
+        with self.assertRaisesRegex(UserError, "Duplicate Entry"):
+            UserTimesheet.create([{**values, 'user': other.user.id}] * 2)
+        with self.assertRaisesRegex(UserError, "Duplicate Entry"):
+            UserTimesheet.write([other], {'user': timesheet.user.id})
+
+    @with_transaction()
+    def test_provision(self):
+        "Test the timesheets are provisioned by chunks"
+        pool = Pool()
+        Company = pool.get('company.company')
+        UserTimesheet = pool.get('afx.user.timesheet')
+        transaction = Transaction()
+
+        company, = Company.search([])
+        existing = self.create_timesheet()
+        employees = [existing.user] + [
+            create_employee(company) for _ in range(5)]
+        today = datetime.date.today()
+        next_month = today.replace(day=1) + datetime.timedelta(days=32)
+        UserTimesheet.write([existing], {
+                'year': str(next_month.year),
+                'month': str(next_month.month),
+                })
+
+        create_timesheets = UserTimesheet.create
+        chunks = []
+
+        def fail_second(vlist):
+            chunks.append(len(vlist))
+            if len(chunks) == 2:
+                raise ValueError("Failed chunk")
+            return create_timesheets(vlist)
+
+        # The chunks are committed in the current transaction
+        with patch.object(UserTimesheet, 'MAIN_COMPANY', company.id), \
+                patch.object(UserTimesheet, 'PROVISION_CHUNK_SIZE', 2), \
+                patch.object(transaction, 'new_transaction',
+                    lambda: contextlib.nullcontext(Mock())):
+            with patch.object(
+                    UserTimesheet, 'create', side_effect=fail_second), \
+                    self.assertLogs(
+                        'trytond.modules.afx_timesheet.user_timesheet',
+                        logging.ERROR):
+                self.assertEqual(UserTimesheet.provision(), 3)
+            self.assertEqual(chunks, [2, 2, 1])
+
+            # The failed chunk is provisioned by the next run
+            self.assertEqual(UserTimesheet.provision(), 2)
+            self.assertEqual(UserTimesheet.provision(), 0)
+
+        self.assertEqual(
+            {t.user for t in UserTimesheet.search([
+                        ('year', '=', str(next_month.year)),
+                        ('month', '=', str(next_month.month)),
+                        ])},
+            set(employees))
+
+    @with_transaction()
+    def test_working_calendar_changes(self):
+        "Test the calendar of the open months follows the company changes"
+        pool = Pool()
+        Holiday = pool.get('afx.timesheet.holiday')
+        UserTimesheet = pool.get('afx.user.timesheet')
+
+        timesheet = self.create_timesheet(sparse=True)
+        company = timesheet.user.company
+        dates = timesheet.get_dates()
+
+        holiday, = Holiday.create([{
+                    'company': company.id,
+                    'date': dates[0],
+                    'name': "Holiday",
+                    }])
+        timesheet = UserTimesheet(timesheet.id)
+        self.assertEqual(timesheet.get_dates(), dates[1:])
+        lines, _ = self.assertSummaryConsistent(timesheet)
+        self.assertEqual(
+            lines, [('', None, len(dates) - 1, 8.0 * (len(dates) - 1))])
+
+        Holiday.delete([holiday])
+        timesheet = UserTimesheet(timesheet.id)
+        self.assertEqual(timesheet.get_dates(), dates)
+
+        company.hours_per_work_day = 4
+        company.hours_per_work_week = 20
+        company.save()
+        timesheet = UserTimesheet(timesheet.id)
+        self.assertEqual(timesheet.get_dates(), dates)
+        self.assertEqual(timesheet.get_default_day(dates[0])['total'], 4)
+        lines, _ = self.assertSummaryConsistent(timesheet)
+        self.assertEqual(lines, [('', None, len(dates), 4.0 * len(dates))])
+
+        # The closed timesheets keep their days
+        days, = UserTimesheet.get_month_records([timesheet])
+        UserTimesheet.submit([timesheet])
+        UserTimesheet.approve([timesheet])
+        UserTimesheet.close([timesheet])
+        Holiday.create([{
+                    'company': company.id,
+                    'date': dates[0],
+                    'name': "Holiday",
+                    }])
+        timesheet = UserTimesheet(timesheet.id)
+        self.assertEqual(UserTimesheet.get_month_records([timesheet]), [days])
+
+    @with_transaction()
+    def test_summary_deltas(self):
+        "Test the summary follows the changes of the records"
+        pool = Pool()
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+
+        timesheet = self.create_timesheet()
+        project = self.create_project()
+        records = UserTimesheetRecord.search([
+                ('timesheet', '=', timesheet.id),
+                ], order=[('date', 'ASC')])
+        days = len(records)
+        hours_per_day = records[0].total
+
+        (lines, total_hours) = self.assertSummaryConsistent(timesheet)
+        self.assertEqual(lines, [('', None, days, hours_per_day * days)])
+        self.assertEqual(total_hours, hours_per_day * days)
+
+        UserTimesheetRecord.write(records[:2], {
+                'task': 'IN_PROJECT',
+                'project': project.id,
+                })
+        UserTimesheetRecord.write(records[2:3], {
+                'task': 'LEAVE_ANNUAL',
+                })
+        UserTimesheetRecord.write(records[:1], {
+                'time_out': datetime.time(12, 0),
+                'total': 3.0,
+                })
+        UserTimesheetRecord.delete(records[-1:])
+
+        (lines, total_hours) = self.assertSummaryConsistent(timesheet)
+        self.assertEqual(lines, [
+                ('', None, days - 4, hours_per_day * (days - 4)),
+                ('IN_PROJECT', project.id, 2, 3.0 + hours_per_day),
+                ('LEAVE_ANNUAL', None, 1, hours_per_day),
+                ])
+        self.assertEqual(
+            total_hours, hours_per_day * (days - 2) + 3.0)
+
+    @with_transaction()
+    def test_summary_user(self):
+        "Test the summary is maintained for a Timesheet User"
+        pool = Pool()
+        Company = pool.get('company.company')
+        UserTimesheet = pool.get('afx.user.timesheet')
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+
+        company, = Company.search([])
+        employee = create_employee(company)
+        user = self.create_user(employee)
+        project = self.create_project()
+        today = datetime.date.today()
+
+        with Transaction().set_user(user.id), \
+                Transaction().set_context(_check_access=True):
+            timesheet, = UserTimesheet.create([{
+                        'user': employee.id,
+                        'year': str(today.year),
+                        'month': str(today.month),
+                        }])
+            records = UserTimesheetRecord.search([
+                    ('timesheet', '=', timesheet.id),
+                    ], order=[('date', 'ASC')])
+            UserTimesheetRecord.write(records[:1], {
+                    'task': 'IN_PROJECT',
+                    'project': project.id,
+                    })
+            UserTimesheetRecord.delete(records[-1:])
+
+        lines, _ = self.assertSummaryConsistent(timesheet)
+        days = len(records)
+        hours = records[0].total
+        self.assertEqual(lines, [
+                ('', None, days - 2, hours * (days - 2)),
+                ('IN_PROJECT', project.id, 1, hours),
+                ])
+
+    @with_transaction()
+    def test_sparse_days(self):
+        "Test the days of a sparse timesheet"
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+
+        timesheet = self.create_timesheet(sparse=True)
+        project = self.create_project()
+        dates = timesheet.get_dates()
+
+        self.assertFalse(self.get_records(timesheet))
+        self.assertEqual([d.date for d in timesheet.records], dates)
+        self.assertEqual(
+            [d['date'] for d in
+                UserTimesheet.get_month_records([timesheet])[0]],
+            dates)
+        day = timesheet.records[0]
+        self.assertEqual(
+            (day.task, day.time_in, day.total),
+            ('', UserTimesheet.DAY_START, UserTimesheet.DEFAULT_HOURS))
+        lines, _ = self.assertSummaryConsistent(timesheet)
+        self.assertEqual(lines, [('', None, len(dates), 8.0 * len(dates))])
+
+        # Editing a default day of the form stores it
+        UserTimesheet.write([timesheet], {
+                'records': [('write', [day.id], {
+                            'task': 'IN_PROJECT',
+                            'project': project.id,
+                            })],
+                })
+        timesheet = UserTimesheet(timesheet.id)
+        record, = self.get_records(timesheet)
+        self.assertEqual(record.date, dates[0])
+        self.assertEqual(record.so_no, 'SO001')
+        self.assertEqual(timesheet.records[0].id, record.id)
+        self.assertEqual(len(timesheet.records), len(dates))
+        lines, _ = self.assertSummaryConsistent(timesheet)
+        self.assertEqual(lines, [
+                ('', None, len(dates) - 1, 8.0 * (len(dates) - 1)),
+                ('IN_PROJECT', project.id, 1, 8.0),
+                ])
+
+        # The page mixes the stored and the default days
+        days, = UserTimesheet.get_month_records(
+            [timesheet], offset=0, limit=2)
+        self.assertEqual([d['date'] for d in days], dates[:2])
+        self.assertEqual([d['id'] for d in days], [record.id, None])
+        days, = UserTimesheet.get_month_records([timesheet], offset=1)
+        self.assertEqual([d['date'] for d in days], dates[1:])
+
+    @with_transaction()
+    def test_export(self):
+        "Test the export merges the default days in date order"
+        pool = Pool()
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+
+        dense = self.create_timesheet()
+        sparse = self.create_timesheet(sparse=True)
+        for timesheet, name in [(dense, 'dense'), (sparse, 'sparse')]:
+            timesheet.user.party.name = name
+            timesheet.user.party.save()
+        project = self.create_project()
+        dates = sparse.get_dates()
+        UserTimesheetRecord.create([{
+                    'timesheet': sparse.id,
+                    'date': dates[1],
+                    'task': 'IN_PROJECT',
+                    'project': project.id,
+                    }])
+        first_day = dates[0].replace(day=1)
+        last_day = (first_day + datetime.timedelta(days=32)).replace(
+            day=1) - datetime.timedelta(days=1)
+
+        for compress in [False, True]:
+            file = io.BytesIO()
+            with patch.object(UserTimesheetRecord, 'EXPORT_CHUNK_SIZE', 1):
+                UserTimesheetRecord.export_csv(
+                    file, first_day, last_day, compress=compress)
+            data = file.getvalue()
+            if compress:
+                data = gzip.decompress(data)
+            header, *rows = csv.reader(
+                io.StringIO(data.decode('utf-8'), newline=''))
+
+            self.assertEqual(header, UserTimesheetRecord.EXPORT_HEADER)
+            self.assertEqual(
+                [r[0] for r in rows], sorted(r[0] for r in rows))
+            self.assertEqual(
+                sorted((r[0], r[1]) for r in rows),
+                sorted([(str(r.date), 'dense')
+                        for r in self.get_records(dense)]
+                    + [(str(d), 'sparse') for d in dates]))
+            self.assertEqual(
+                [(r[2], r[3], r[4]) for r in rows
+                    if r[1] == 'sparse' and r[0] == str(dates[1])],
+                [('IN_PROJECT', project.rec_name, 'SO001')])
+
+    @with_transaction()
+    def test_import_validate_lines(self):
+        "Test the import reports the errors of all the lines"
+        pool = Pool()
+        Import = pool.get('afx.user.timesheet.record.import', type='wizard')
+
+        timesheet = self.create_timesheet()
+        project = self.create_project()
+        dates = timesheet.get_dates()
+        header = ['Date', 'Status', 'S/O Number', 'Time In', 'Time Out']
+        data = '\n'.join(','.join(row) for row in [
+                header,
+                [str(dates[0]), 'IN_PROJECT', 'SO001', '09:00', '17:30'],
+                [str(dates[0]), 'LEAVE_ANNUAL', '', '', ''],
+                ['2000-01-01', 'LEAVE_ANNUAL', '', '', ''],
+                ['01/02/2000', 'UNKNOWN', '', '', ''],
+                [str(dates[1]), 'IN_PROJECT', '', '9h', ''],
+                [str(dates[2]), 'IN_PROJECT', 'SO999', '', ''],
+                ]).encode('utf-8-sig')
+
+        to_write, errors = Import.validate_lines(
+            timesheet, Import.parse(data))
+
+        (date, record, values), = to_write
+        self.assertEqual((date, record.date), (dates[0], dates[0]))
+        self.assertEqual(
+            (values['project'], values['so_no'], values['total']),
+            (project.id, 'SO001', 8.5))
+        self.assertEqual(errors, [
+                (3, f"Date {dates[0]} is already on line 2."),
+                (4, "Date 2000-01-01 is not in the timesheet."),
+                (5, "Invalid date '01/02/2000'."),
+                (5, "Unknown status 'UNKNOWN'."),
+                (6, "Missing S/O Number."),
+                (6, "Invalid Time In '9h'."),
+                (7, "No project with S/O Number 'SO999'."),
+                ])
+
+    @with_transaction()
+    def test_sparse_several_records_per_date(self):
+        "Test the default day is replaced by the records of its date"
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+
+        timesheet = self.create_timesheet(sparse=True)
+        dates = timesheet.get_dates()
+        values = {
+            'timesheet': timesheet.id,
+            'date': dates[0],
+            'task': 'IN_PROJECT',
+            'total': 2.0,
+            }
+        morning, afternoon = UserTimesheetRecord.create([{
+                    'time_in': datetime.time(8, 0),
+                    'time_out': datetime.time(10, 0),
+                    **values,
+                    }, {
+                    'time_in': datetime.time(14, 0),
+                    'time_out': datetime.time(16, 0),
+                    **values,
+                    }])
+        evening, = UserTimesheetRecord.create([{
+                    'time_in': datetime.time(18, 0),
+                    'time_out': datetime.time(20, 0),
+                    **values,
+                    }])
+
+        days, = UserTimesheet.get_month_records([timesheet])
+        self.assertEqual(
+            [d['id'] for d in days if d['date'] == dates[0]],
+            [morning.id, afternoon.id, evening.id])
+        self.assertEqual(len(days), len(dates) + 2)
+        lines, _ = self.assertSummaryConsistent(timesheet)
+        self.assertEqual(lines, [
+                ('', None, len(dates) - 1, 8.0 * (len(dates) - 1)),
+                ('IN_PROJECT', None, 3, 6.0),
+                ])
+
+        UserTimesheetRecord.delete([morning, afternoon])
+        lines, _ = self.assertSummaryConsistent(timesheet)
+        self.assertEqual(lines, [
+                ('', None, len(dates) - 1, 8.0 * (len(dates) - 1)),
+                ('IN_PROJECT', None, 1, 2.0),
+                ])
+
+        # The date of the last record gets its default day back
+        UserTimesheetRecord.write([evening], {'date': dates[1]})
+        lines, _ = self.assertSummaryConsistent(timesheet)
+        self.assertEqual(lines, [
+                ('', None, len(dates) - 1, 8.0 * (len(dates) - 1)),
+                ('IN_PROJECT', None, 1, 2.0),
+                ])
+        UserTimesheetRecord.delete([evening])
+        lines, _ = self.assertSummaryConsistent(timesheet)
+        self.assertEqual(lines, [('', None, len(dates), 8.0 * len(dates))])
+
+    @with_transaction()
+    def test_month_grid(self):
+        "Test the month grid adds up the records of a date"
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+
+        timesheet = self.create_timesheet()
+        sparse = self.create_timesheet(sparse=True)
+        company = timesheet.user.company
+        dates = sparse.get_dates()
+        record = self.get_records(timesheet)[0]
+        UserTimesheetRecord.write([record], {
+                'task': 'LEAVE_HALFDAY',
+                'time_out': datetime.time(13, 0),
+                'total': 4.0,
+                })
+        UserTimesheetRecord.create([{
+                    'timesheet': timesheet.id,
+                    'date': record.date,
+                    'task': 'IN_PROJECT',
+                    'time_in': datetime.time(14, 0),
+                    'time_out': datetime.time(16, 0),
+                    'total': 2.0,
+                    }, {
+                    'timesheet': sparse.id,
+                    'date': dates[0],
+                    'task': 'IN_PROJECT',
+                    'time_in': datetime.time(9, 0),
+                    'time_out': datetime.time(11, 0),
+                    'total': 2.0,
+                    }])
+
+        grid = UserTimesheet.get_month_grid(
+            company.id, timesheet.year, timesheet.month)
+
+        employees = {e[0]: e[1:] for e in grid['employees']}
+        self.assertEqual(set(employees), {timesheet.user.id, sparse.user.id})
+        column = grid['dates'].index(record.date)
+        _, tasks, hours = employees[timesheet.user.id]
+        self.assertEqual(
+            (tasks[column], hours[column]), ('LEAVE_HALFDAY,IN_PROJECT', 6.0))
+        _, tasks, hours = employees[sparse.user.id]
+        column = grid['dates'].index(dates[0])
+        self.assertEqual((tasks[column], hours[column]), ('IN_PROJECT', 2.0))
+        column = grid['dates'].index(dates[1])
+        self.assertEqual(
+            (tasks[column], hours[column]),
+            ('', UserTimesheet.DEFAULT_HOURS))
+
+    @with_transaction()
+    def test_month_grid_rule(self):
+        "Test the month grid only shows the timesheets of the user"
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+
+        timesheet = self.create_timesheet()
+        self.create_timesheet()
+        employee = timesheet.user
+        user = self.create_user(employee)
+
+        with Transaction().set_user(user.id), \
+                Transaction().set_context(_check_access=True):
+            grid = UserTimesheet.get_month_grid(
+                employee.company.id, timesheet.year, timesheet.month)
+
+        self.assertEqual([e[0] for e in grid['employees']], [employee.id])
+
+    @with_transaction()
+    def test_edit_days(self):
+        "Test editing the days of a weekday in bulk"
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+
+        dense = self.create_timesheet()
+        sparse = self.create_timesheet(sparse=True)
+        project = self.create_project()
+        dates = sparse.get_dates()
+        mondays = [d for d in dates[1:] if d.weekday() == 0]
+
+        with patch.object(UserTimesheetRecord, 'write',
+                wraps=UserTimesheetRecord.write) as write:
+            edited = UserTimesheet.edit_days([dense, sparse], {
+                    'task': 'IN_PROJECT',
+                    'project': project.id,
+                    'time_out': datetime.time(18, 0),
+                    }, from_date=dates[1], weekdays=[0])
+        write.assert_called_once()
+
+        self.assertEqual(len(edited), 2 * len(mondays))
+        self.assertEqual([r.date for r in self.get_records(sparse)], mondays)
+        for timesheet in [dense, sparse]:
+            self.assertEqual(
+                {(r.date, r.so_no, r.total)
+                    for r in self.get_records(timesheet)
+                    if r.task == 'IN_PROJECT'},
+                {(d, 'SO001', 9.0) for d in mondays})
+            self.assertSummaryConsistent(timesheet)
+
+        with self.assertRaisesRegex(UserError, "Invalid Fields"):
+            UserTimesheet.edit_days([dense], {'total': 1})
+
+    @with_transaction()
+    def test_copy_previous_month(self):
+        "Test copying the days of the previous month"
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+        ProjectTask = pool.get('afx.project.task')
+
+        previous = self.create_timesheet()
+        project = self.create_project()
+        next_month = (
+            datetime.date(int(previous.year), int(previous.month), 1)
+            + datetime.timedelta(days=32))
+        timesheet, = UserTimesheet.create([{
+                    'user': previous.user.id,
+                    'year': str(next_month.year),
+                    'month': str(next_month.month),
+                    }])
+        # The last day of each weekday is copied
+        UserTimesheetRecord.write(self.get_records(previous)[-7:], {
+                'task': 'IN_PROJECT',
+                'project': project.id,
+                'detail': "Copied",
+                })
+
+        copied = UserTimesheet.copy_from_previous_month([timesheet])
+
+        records = self.get_records(timesheet)
+        self.assertEqual(sorted(copied), records)
+        self.assertEqual(
+            {(r.task, r.project, r.so_no, r.detail) for r in records},
+            {('IN_PROJECT', project, 'SO001', "Copied")})
+        lines, _ = self.assertSummaryConsistent(timesheet)
+        self.assertEqual(
+            lines, [('IN_PROJECT', project.id, len(records),
+                    sum(r.total for r in records))])
+        self.assertEqual(ProjectTask.search([
+                    ('unique_id', 'in', [r.unique_id for r in records]),
+                    ], count=True), len(records))
+
+    @with_transaction()
+    def test_copy_previous_month_leave(self):
+        "Test the leave days of the previous month are not copied"
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+
+        previous = self.create_timesheet()
+        project = self.create_project()
+        next_month = (
+            datetime.date(int(previous.year), int(previous.month), 1)
+            + datetime.timedelta(days=32))
+        timesheet, = UserTimesheet.create([{
+                    'user': previous.user.id,
+                    'year': str(next_month.year),
+                    'month': str(next_month.month),
+                    }])
+        records = self.get_records(previous)
+        UserTimesheetRecord.write(records[-14:-7], {
+                'task': 'IN_PROJECT',
+                'project': project.id,
+                'detail': "Worked",
+                }, records[-7:], {
+                'task': 'LEAVE_ANNUAL',
+                })
+
+        UserTimesheet.copy_from_previous_month([timesheet])
+
+        records = self.get_records(timesheet)
+        self.assertEqual(
+            {(r.task, r.project, r.detail) for r in records},
+            {('IN_PROJECT', project, "Worked")})
+
+    @with_transaction()
+    def test_copy_previous_month_check_times(self):
+        "Test copying the days of the previous month checks the times"
+        pool = Pool()
+        Configuration = pool.get('afx.timesheet.configuration')
+        UserTimesheet = pool.get('afx.user.timesheet')
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+
+        previous = self.create_timesheet()
+        next_month = (
+            datetime.date(int(previous.year), int(previous.month), 1)
+            + datetime.timedelta(days=32))
+        timesheet, = UserTimesheet.create([{
+                    'user': previous.user.id,
+                    'year': str(next_month.year),
+                    'month': str(next_month.month),
+                    }])
+        configuration = Configuration(1)
+        configuration.max_daily_hours = 10
+        configuration.save()
+        UserTimesheetRecord.write(self.get_records(previous)[-7:], {
+                'time_out': datetime.time(19, 0),
+                'total': 10.0,
+                })
+        configuration.max_daily_hours = 9
+        configuration.save()
+
+        with self.assertRaisesRegex(UserError, "daily cap"):
+            UserTimesheet.copy_from_previous_month([timesheet])
+
+    @with_transaction()
+    def test_changes(self):
+        "Test the change feed pages the changes and the deletions"
+        pool = Pool()
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+
+        timesheet = self.create_timesheet()
+        records = self.get_records(timesheet)
+
+        with patch.object(
+                UserTimesheetRecord, 'CHANGES_DELAY',
+                datetime.timedelta(minutes=-1)):
+            changed, cursor, more = [], None, True
+            while more:
+                changes = UserTimesheetRecord.get_changes(cursor, limit=5)
+                self.assertLessEqual(len(changes['changed']), 5)
+                changed.extend(changes['changed'])
+                cursor, more = changes['cursor'], changes['more']
+            id_index = changes['fields'].index('id')
+            self.assertEqual(
+                [c[id_index] for c in changed
+                    if c[changes['fields'].index('timesheet')]
+                    == timesheet.id],
+                [r.id for r in records])
+
+            record = records[0]
+            unique_id = record.unique_id
+            UserTimesheetRecord.delete([record])
+            changes = UserTimesheetRecord.get_changes(cursor)
+
+        self.assertEqual(changes['changed'], [])
+        self.assertEqual(changes['deleted'], [[record.id, unique_id]])
+        self.assertFalse(changes['more'])
+
+    @with_transaction()
+    def test_changes_user(self):
+        "Test the change feed only returns the timesheets of the user"
+        pool = Pool()
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+
+        timesheet = self.create_timesheet()
+        other = self.create_timesheet()
+        user = self.create_user(timesheet.user)
+        record = self.get_records(timesheet)[0]
+        record_id, unique_id = record.id, record.unique_id
+        UserTimesheetRecord.delete([record])
+        UserTimesheetRecord.delete(self.get_records(other)[:1])
+
+        with patch.object(
+                UserTimesheetRecord, 'CHANGES_DELAY',
+                datetime.timedelta(minutes=-1)), \
+                Transaction().set_user(user.id), \
+                Transaction().set_context(_check_access=True):
+            changes = UserTimesheetRecord.get_changes()
+
+        index = changes['fields'].index('timesheet')
+        self.assertEqual(
+            {c[index] for c in changes['changed']}, {timesheet.id})
+        self.assertEqual(changes['deleted'], [[record_id, unique_id]])
+
+    @with_transaction()
+    def test_project_so_no(self):
+        "Test the S/O Number of the project is propagated to open months"
+        pool = Pool()
+        Project = pool.get('afx.project')
+        UserTimesheet = pool.get('afx.user.timesheet')
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+
+        project = self.create_project()
+        timesheet = self.create_timesheet()
+        closed = self.create_timesheet()
+        records = self.get_records(timesheet)[:2]
+        closed_records = self.get_records(closed)[:2]
+        UserTimesheetRecord.write(records + closed_records, {
+                'task': 'IN_PROJECT',
+                'project': project.id,
+                })
+        UserTimesheet.submit([closed])
+        UserTimesheet.approve([closed])
+        UserTimesheet.close([closed])
+
+        Project.write([project], {'so_no': 'SO002'})
+
+        self.assertEqual(
+            {r['so_no'] for r in UserTimesheetRecord.read(
+                    [r.id for r in records], ['so_no'])},
+            {'SO002'})
+        self.assertEqual(
+            {r['so_no'] for r in UserTimesheetRecord.read(
+                    [r.id for r in closed_records], ['so_no'])},
+            {'SO001'})
+
+    @with_transaction()
+    def test_unique_id_migration(self):
+        "Test the migration of the unique_id keeps the project tasks"
+        pool = Pool()
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+        ProjectTask = pool.get('afx.project.task')
+        record = UserTimesheetRecord.__table__()
+        task = ProjectTask.__table__()
+        cursor = Transaction().connection.cursor()
+
+        timesheet = self.create_timesheet()
+        project = self.create_project()
+        records = self.get_records(timesheet)[:3]
+        UserTimesheetRecord.write(records, {
+                'task': 'IN_PROJECT',
+                'project': project.id,
+                })
+        self.assertTrue(all(
+                len(r.unique_id) == 32 and int(r.unique_id, 16) >= 0
+                for r in self.get_records(timesheet)))
+
+        # The former unique_id was "tsr_" + a SHA-256 hex digest
+        legacy = {}
+        for record_ in records:
+            digest = hashlib.sha256(str(record_.id).encode()).hexdigest()
+            legacy[record_.id] = digest[:32]
+            for table in [record, task]:
+                cursor.execute(*table.update(
+                        [table.unique_id], ['tsr_' + digest],
+                        where=table.unique_id == record_.unique_id))
+
+        UserTimesheetRecord.__register__('afx_timesheet')
+
+        cursor.execute(*record.join(
+                task, condition=task.unique_id == record.unique_id
+                ).select(
+                    record.id, record.unique_id,
+                    where=record.id.in_(list(legacy))))
+        self.assertEqual(dict(cursor), legacy)
+
+    @with_transaction()
+    def test_sync_project_tasks(self):
+        "Test the project members and tasks follow the records"
+        pool = Pool()
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+        ProjectMember = pool.get('afx.project.member')
+        ProjectTask = pool.get('afx.project.task')
+
+        timesheet = self.create_timesheet()
+        other = self.create_timesheet()
+        project = self.create_project()
+        records = (
+            self.get_records(timesheet)[:3] + self.get_records(other)[:2])
+        unique_ids = [r.unique_id for r in records]
+
+        UserTimesheetRecord.write(records, {
+                'task': 'IN_PROJECT',
+                'project': project.id,
+                'detail': "Design",
+                })
+        members = ProjectMember.search([('project', '=', project.id)])
+        self.assertEqual(
+            {m.member for m in members}, {timesheet.user, other.user})
+        tasks = ProjectTask.search([('unique_id', 'in', unique_ids)])
+        self.assertEqual(len(tasks), len(records))
+        self.assertEqual(
+            {(t.pic.member, t.activity) for t in tasks},
+            {(timesheet.user, "Design"), (other.user, "Design")})
+
+        # Only the changed values are written
+        with patch.object(
+                ProjectTask, 'write', wraps=ProjectTask.write) as write:
+            UserTimesheetRecord.write(records, {'detail': "Build"})
+        write.assert_called_once()
+        self.assertEqual(write.call_args.args[1::2], ({'activity': "Build"},))
+        self.assertEqual(
+            {t.activity for t in ProjectTask.search([
+                        ('unique_id', 'in', unique_ids)])},
+            {"Build"})
+
+        # The tasks of the records leaving the project are deleted
+        UserTimesheetRecord.write(records[:1], {'project': None})
+        self.assertEqual(
+            ProjectTask.search([('unique_id', 'in', unique_ids)], count=True),
+            len(records) - 1)
+
+    @with_transaction()
+    def test_sync_queue(self):
+        "Test the deferred synchronisation of the project tasks"
+        pool = Pool()
+        Configuration = pool.get('afx.timesheet.configuration')
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+        UserTimesheetRecordSync = pool.get('afx.user.timesheet.record.sync')
+        ProjectTask = pool.get('afx.project.task')
+        transaction = Transaction()
+
+        configuration = Configuration(1)
+        configuration.project_sync_mode = 'deferred'
+        configuration.save()
+        timesheet = self.create_timesheet()
+        project = self.create_project()
+        records = UserTimesheetRecord.search([
+                ('timesheet', '=', timesheet.id),
+                ], order=[('date', 'ASC')], limit=3)
+        UserTimesheetRecord.write(records, {
+                'task': 'IN_PROJECT',
+                'project': project.id,
+                })
+        # The entry of a deleted record is removed with it
+        UserTimesheetRecord.delete(records[-1:])
+        unique_ids = [r.unique_id for r in records[:2]]
+
+        self.assertEqual(
+            UserTimesheetRecordSync.search([], count=True), 2)
+        self.assertFalse(
+            ProjectTask.search([('unique_id', 'in', unique_ids)]))
+        # The batches are processed in their own transactions
+        transaction.commit()
+        try:
+            UserTimesheetRecordSync.process()
+
+            self.assertFalse(UserTimesheetRecordSync.search([]))
+            tasks = ProjectTask.search([('unique_id', 'in', unique_ids)])
+            self.assertEqual(len(tasks), 2)
+            self.assertEqual({t.project for t in tasks}, {project})
+            self.assertEqual(
+                UserTimesheetRecordSync.get_status()['depth'], 0)
+            # The entries deleted meanwhile are skipped
+            UserTimesheetRecordSync._reschedule(-1, Exception())
+        finally:
+            configuration.project_sync_mode = 'immediate'
+            configuration.save()
+            transaction.commit()
+
+    @with_transaction()
+    def test_instrumentation(self):
+        "Test the measures of the sampled calls"
+        pool = Pool()
+        Configuration = pool.get('afx.timesheet.configuration')
+        Instrumentation = pool.get('afx.timesheet.instrumentation')
+        UserTimesheet = pool.get('afx.user.timesheet')
+        transaction = Transaction()
+        loggers = [
+            logging.getLogger('trytond.backend.postgresql.database'),
+            logging.getLogger('trytond.backend.sqlite.database'),
+            ]
+        levels = [l.level for l in loggers]
+
+        configuration = Configuration(1)
+        configuration.instrumentation_sample_rate = 1
+        configuration.instrumentation_retention_days = 10
+        configuration.save()
+        # The measures are stored in their own transaction
+        transaction.commit()
+        try:
+            with patch.object(Instrumentation, 'FLUSH_SIZE', 1):
+                UserTimesheet.search([])
+            transaction.commit()
+
+            measure, = Instrumentation.search([
+                    ('method', '=', 'afx.user.timesheet.search'),
+                    ])
+            self.assertEqual(measure.queries, 1)
+            self.assertEqual(measure.user.id, transaction.user)
+            self.assertEqual([l.level for l in loggers], levels)
+
+            Instrumentation.purge()
+            self.assertEqual(Instrumentation.search([], count=True), 1)
+            table = Instrumentation.__table__()
+            cursor = transaction.connection.cursor()
+            cursor.execute(*table.update(
+                    [table.create_date],
+                    [datetime.datetime.now() - datetime.timedelta(days=11)]))
+            Instrumentation.purge()
+            self.assertEqual(Instrumentation.search([], count=True), 0)
+        finally:
+            configuration.instrumentation_sample_rate = 0
+            configuration.save()
+            Instrumentation.delete(Instrumentation.search([]))
+            transaction.commit()
+
+    @with_transaction()
+    def test_check_times_overlap(self):
+        "Test the overlapping times of an employee are refused"
+        pool = Pool()
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+
+        timesheet = self.create_timesheet()
+        record = self.get_records(timesheet)[0]
+
+        with self.assertRaisesRegex(UserError, "overlap"):
+            UserTimesheetRecord.create([{
+                        'timesheet': timesheet.id,
+                        'date': record.date,
+                        'task': 'IN_PROJECT',
+                        'time_in': datetime.time(10, 0),
+                        'time_out': datetime.time(11, 0),
+                        'total': 1.0,
+                        }])
+
+    @with_transaction()
+    def test_check_times_overnight(self):
+        "Test the overnight times overlap the next day"
+        pool = Pool()
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+
+        timesheet = self.create_timesheet()
+        record = self.get_records(timesheet)[0]
+
+        # Ends at 10:00 the next day which starts at 9:00
+        with self.assertRaisesRegex(UserError, "overlap"):
+            UserTimesheetRecord.create([{
+                        'timesheet': timesheet.id,
+                        'date': record.date - datetime.timedelta(days=1),
+                        'task': 'IN_PROJECT',
+                        'time_in': datetime.time(22, 0),
+                        'time_out': datetime.time(10, 0),
+                        'total': 12.0,
+                        }])
+
+    @with_transaction()
+    def test_check_times_daily_cap(self):
+        "Test the hours of a day above the daily cap are refused"
+        pool = Pool()
+        Configuration = pool.get('afx.timesheet.configuration')
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+
+        timesheet = self.create_timesheet()
+        record = self.get_records(timesheet)[0]
+        configuration = Configuration(1)
+        configuration.max_daily_hours = 10
+        configuration.save()
+
+        UserTimesheetRecord.write([record], {
+                'time_out': datetime.time(19, 0),
+                'total': 10.0,
+                })
+        with self.assertRaisesRegex(UserError, "daily cap"):
+            UserTimesheetRecord.write([record], {
+                    'time_out': datetime.time(20, 0),
+                    'total': 11.0,
+                    })
+
+    @with_transaction()
+    def test_archive(self):
+        "Test archiving the timesheets of the months before a month"
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+
+        timesheet = self.create_timesheet()
+        year, month = int(timesheet.year), int(timesheet.month)
+
+        self.assertEqual(UserTimesheet.archive(year, month), 0)
+        self.assertEqual(UserTimesheet.archive(year, 1), 0)
+        self.assertEqual(UserTimesheet.search([]), [timesheet])
+
+        next_month = (
+            datetime.date(year, month, 1) + datetime.timedelta(days=32))
+        self.assertEqual(
+            UserTimesheet.archive(next_month.year, next_month.month), 1)
+        self.assertFalse(UserTimesheet.search([]))
+        self.assertFalse(self.get_records(timesheet))
+
+    @with_transaction()
+    def test_month_hours_closed_cache(self):
+        "Test the hours of the closed months are cached until a change"
+        pool = Pool()
+        ProjectHours = pool.get('afx.user.timesheet.project_hours')
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+        record = UserTimesheetRecord.__table__()
+        cursor = Transaction().connection.cursor()
+
+        timesheet = self.create_timesheet()
+        project = self.create_project()
+        year, month = int(timesheet.year), int(timesheet.month)
+        records = self.get_records(timesheet)
+        UserTimesheetRecord.write(records, {
+                'task': 'IN_PROJECT',
+                'project': project.id,
+                })
+        total = sum(r.total for r in records)
+
+        next_month = (
+            datetime.date(year, month, 1)
+            + datetime.timedelta(days=32)).replace(day=1)
+        date = Mock(wraps=datetime.date, **{'today.return_value': next_month})
+
+        def hours():
+            (_, _, _, days, hours), = ProjectHours.get_month_hours(
+                year, month)
+            return days, hours
+
+        # The month is closed once the next month has started
+        with patch(
+                'trytond.modules.afx_timesheet.user_timesheet_project_hours'
+                '.datetime', Mock(date=date)):
+            self.assertEqual(hours(), (len(records), total))
+            # A change bypassing the records is not seen while cached
+            cursor.execute(*record.update(
+                    [record.total], [0], where=record.id == records[0].id))
+            self.assertEqual(hours(), (len(records), total))
+
+            ProjectHours.clear_closed_months([next_month])
+            self.assertEqual(hours(), (len(records), total))
+            ProjectHours.clear_closed_months([records[0].date])
+            self.assertEqual(
+                hours(), (len(records), total - records[0].total))
+
+    @with_transaction()
+    def test_month_hours_archived(self):
+        "Test the month hours include the archived records on request"
+        pool = Pool()
+        ProjectHours = pool.get('afx.user.timesheet.project_hours')
+        UserTimesheet = pool.get('afx.user.timesheet')
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+
+        timesheet = self.create_timesheet()
+        project = self.create_project()
+        year, month = int(timesheet.year), int(timesheet.month)
+        records = self.get_records(timesheet)
+        UserTimesheetRecord.write(records, {
+                'task': 'IN_PROJECT',
+                'project': project.id,
+                })
+        hours = [(
+                project.id, 'SO001', timesheet.user.id, len(records),
+                sum(r.total for r in records))]
+        self.assertEqual(
+            list(ProjectHours.get_month_hours(year, month)), hours)
+
+        UserTimesheet.write([timesheet], {'active': False})
+
+        self.assertFalse(ProjectHours.get_month_hours(year, month))
+        with Transaction().set_context(include_archived=True):
+            self.assertEqual(
+                list(ProjectHours.get_month_hours(year, month)), hours)
+            self.assertEqual(
+                [(h.project, h.days) for h in ProjectHours.search([])],
+                [(project, len(records))])
+
+    @with_transaction()
+    def test_close(self):
+        "Test closing a timesheet freezes its month"
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+
+        timesheet = self.create_timesheet()
+        project = self.create_project()
+        record = self.get_records(timesheet)[0]
+        UserTimesheetRecord.write([record], {
+                'task': 'IN_PROJECT',
+                'project': project.id,
+                })
+        days, = UserTimesheet.get_month_records([timesheet])
+
+        UserTimesheet.submit([timesheet])
+        UserTimesheet.approve([timesheet])
+        UserTimesheet.close([timesheet])
+        timesheet = UserTimesheet(timesheet.id)
+
+        self.assertEqual(timesheet.state, 'closed')
+        self.assertTrue(timesheet.snapshot)
+        snapshot = UserTimesheet.get_snapshots([timesheet])[timesheet.id]
+        self.assertEqual(
+            snapshot['projects'], [[project.id, 'SO001', 1, record.total]])
+        with self.assertRaisesRegex(UserError, "closed"):
+            UserTimesheetRecord.write([record], {'detail': "Changed"})
+        with self.assertRaisesRegex(UserError, "closed"):
+            UserTimesheetRecord.delete([record])
+
+        # The closed month is read from the snapshot
+        self.assertEqual(UserTimesheet.get_month_records([timesheet]), [days])
 
 
 del ModuleTestCase
@@ -0,0 +1,63 @@
+# This file is part of Tryton.  The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+"""
+Stand-in project models for the tests of the timesheet module.
+
+The timesheet records link to the afx.project models of the afx_project
+module. When this module is not available, minimal stand-in models are
+registered so the timesheet module can be activated by the tests. The
+stand-in project includes the extension of the timesheet module.
+"""
+import importlib
+
+from trytond.model import ModelSQL, fields
+from trytond.modules import get_modules
+from trytond.modules.afx_timesheet import project
+from trytond.pool import Pool
+
+# The pool is started when the test framework is imported so the stand-ins
+# must be registered after it
+importlib.import_module('trytond.tests.test_tryton')
+
+
+class Project(project.Project, ModelSQL):
+    "Project"
+    __name__ = 'afx.project'
+    name = fields.Char("Name")
+    so_no = fields.Char("S/O Number")
+
+
+class ProjectMember(ModelSQL):
+    "Project Member"
+    __name__ = 'afx.project.member'
+    project = fields.Many2One('afx.project', "Project")
+    member = fields.Many2One('company.employee', "Member")
+    role = fields.Char("Role")
+    rate = fields.Float("Rate")
+    est_start_date = fields.Date("Estimated Start Date")
+    est_end_date = fields.Date("Estimated End Date")
+
+
+class ProjectTask(ModelSQL):
+    "Project Task"
+    __name__ = 'afx.project.task'
+    unique_id = fields.Char("Uuid")
+    project = fields.Many2One('afx.project', "Project")
+    activity = fields.Text("Activity")
+    pic = fields.Many2One('afx.project.member', "PIC")
+    start_time = fields.Time("Start Time")
+    end_time = fields.Time("End Time")
+    total_hours = fields.Float("Total Hours")
+    priority = fields.Char("Priority")
+    status = fields.Char("Status")
+
+
+if 'afx_project' in get_modules():
+    EXTRAS = ['afx_project']
+else:
+    EXTRAS = []
+    Pool.register(
+        Project,
+        ProjectMember,
+        ProjectTask,
+        module='afx_timesheet', type_='model')
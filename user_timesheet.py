@@ -1,46 +1,124 @@
-from trytond.model import ModelSQL, ModelView, fields
+from trytond.model import (
+    DeactivableMixin, Index, ModelSQL, ModelView, Unique, Workflow, fields)
 from trytond.transaction import Transaction
 from trytond.exceptions import UserError
 from trytond.pyson import Eval
 from trytond.pool import Pool
+from trytond.tools import grouped_slice, reduce_ids
+from trytond.rpc import RPC
+from trytond.cache import Cache
+from .instrumentation import instrumented
+from sql import Literal
 from datetime import time
 import datetime
 import calendar
+import json
 import logging
-import hashlib
-import os
+from collections import defaultdict
+from itertools import chain
 
 logger = logging.getLogger(__name__)
 
-class UserTimesheet(ModelSQL, ModelView):
+class UserTimesheet(DeactivableMixin, Workflow, ModelSQL, ModelView):
     "User Timesheet"
     __name__ = 'afx.user.timesheet'
 
     # Hardcoded
     MAIN_COMPANY = 1
-    UUID_PREFIX = "tsr_"
-    ADMIN = "Timesheet Administration"
+    PROVISION_CHUNK_SIZE = 200
+    DAY_START = time(9, 0)
+    DEFAULT_HOURS = 8.0
+    MONTH_RECORD_FIELDS = [
+        'id', 'unique_id', 'date', 'day', 'task', 'project', 'detail',
+        'so_no', 'time_in', 'time_out', 'total']
 
-    year = fields.Selection([], "Year", help='Format: YYYY', required=True, states={
+    _working_calendar_cache = Cache(
+        'afx.user.timesheet.working_calendar', context=False)
+
+    year = fields.Selection('_year_get', "Year", help='Format: YYYY', required=True, states={
         'readonly': Eval('id', -1) > 0
     }, depends=['id'])
-    month = fields.Selection([], "Month", sort=False, required=True, states={
+    month = fields.Selection('_month_get', "Month", sort=False, required=True, states={
         'readonly': Eval('id', -1) > 0
     }, depends=['id'])
     user = fields.Many2One('company.employee', "User", required=True, domain=[
         ('company', '=', MAIN_COMPANY)
     ])
-    records = fields.One2Many('afx.user.timesheet.record', 'timesheet', "Records", required=False, domain=[
-        ('date.month', '=', Eval('month'))
-    ])
+    # The days of sparse timesheets which are not stored are shown too
+    records = fields.One2Many('afx.user.timesheet.day', 'timesheet', "Records", required=False,
+        order=[('date', 'ASC'), ('id', 'ASC')], states={
+        'readonly': Eval('state') == 'closed',
+    })
+    total_hours = fields.Float(
+        "Total Hours", digits=(16, 2), readonly=True,
+        help="Sum of the total hours of the records.")
+    summaries = fields.One2Many(
+        'afx.user.timesheet.summary', 'timesheet', "Summary", readonly=True,
+        help="Hours and days by status and project.")
+    sparse = fields.Boolean(
+        "Sparse", readonly=True,
+        help="Only the days which differ from the default are stored.")
+    state = fields.Selection([
+            ('draft', "Draft"),
+            ('submitted', "Submitted"),
+            ('approved', "Approved"),
+            ('closed', "Closed"),
+            ], "State", readonly=True, required=True, sort=False)
+    snapshot = fields.Text(
+        "Snapshot", readonly=True,
+        help="The days and the project split of the closed month.")
 
     @classmethod
     def __setup__(cls):
         super().__setup__()
-        cls.year.selection = cls._year_get()
-        cls.month.selection = cls._month_get()
 
-    def _year_get():
+        t = cls.__table__()
+        # The unique index also serves the lookups by user
+        cls._sql_constraints += [
+            ('user_year_month_unique', Unique(t, t.user, t.year, t.month),
+                'afx_timesheet.msg_user_timesheet_user_year_month_unique'),
+            ]
+        # Used by the month grid
+        cls._sql_indexes.add(
+            Index(t, (t.year, Index.Equality()), (t.month, Index.Equality())))
+        cls._transitions |= {
+            ('draft', 'submitted'),
+            ('submitted', 'draft'),
+            ('submitted', 'approved'),
+            ('approved', 'draft'),
+            ('approved', 'closed'),
+            }
+        cls._buttons.update({
+                'draft': {
+                    'invisible': ~Eval('state').in_(['submitted', 'approved']),
+                    'icon': 'tryton-back',
+                    },
+                'submit': {
+                    'invisible': Eval('state') != 'draft',
+                    'icon': 'tryton-forward',
+                    },
+                'approve': {
+                    'invisible': Eval('state') != 'submitted',
+                    'icon': 'tryton-ok',
+                    },
+                'close': {
+                    'invisible': Eval('state') != 'approved',
+                    'icon': 'tryton-close',
+                    },
+                'copy_previous_month': {
+                    'invisible': Eval('state') == 'closed',
+                    },
+                'rebuild_summary': {},
+                })
+        cls.__rpc__.update({
+                'get_month_records': RPC(instantiate=0),
+                'edit_days': RPC(readonly=False, instantiate=0),
+                'get_month_grid': RPC(),
+                })
+
+    @classmethod
+    def _year_get(cls):
+        # Computed on each call to follow the current month
         today = datetime.date.today()
         # Rule 1: If the month is December, include this year and the previous year
         if today.month == 12:
@@ -48,10 +126,14 @@ class UserTimesheet(ModelSQL, ModelView):
         # Rule 2: Otherwise, include only this year
         else:
             years = [(str(today.year), str(today.year))]
+        # Rule 3: In December, include next year to provision January in advance
+        if today.month == 12:
+            years.append((str(today.year + 1), str(today.year + 1)))
         # Add the default empty tuple at the beginning
         return [] + years
     
-    def _month_get():
+    @classmethod
+    def _month_get(cls):
         today = datetime.date.today()
         current_month = today.month
         months = [
@@ -59,134 +141,830 @@ class UserTimesheet(ModelSQL, ModelView):
             ('5', 'MAY'), ('6', 'JUN'), ('7', 'JUL'), ('8', 'AUG'),
             ('9', 'SEP'), ('10', 'OCT'), ('11', 'NOV'), ('12', 'DEC')
         ]
+        # Include the next month to provision its timesheets in advance
         if current_month == 1:
-            result = months[-1:] + months[:current_month]
+            result = months[-1:] + months[:current_month + 1]
         else:
-            result = months[:current_month]
+            result = months[:current_month + 1]
         return [] + result
     
     # ------- DEFAULT VALUES --------    
+    @classmethod
+    def default_total_hours(cls):
+        return 0.0
+
+    @classmethod
+    def default_state(cls):
+        return 'draft'
+
+    @classmethod
+    def default_sparse(cls):
+        pool = Pool()
+        Configuration = pool.get('afx.timesheet.configuration')
+        return bool(Configuration(1).sparse_records)
+
     @classmethod
     def default_user(cls):
-        if (Transaction().user - 1) < 1:
-            return None
-        else:
-            return Transaction().user
+        # The current employee of the user, like the record rules
+        return Transaction().context.get('employee')
         
-    # -------- ONCHANGE METHOD --------
-    @fields.depends('month', 'records')
-    def on_change_month(self):
-        """
-        When the month changes, filter the records to only include those
-        matching the selected month.
-        """
-        if self.month:
-            # Clear existing records that do not match the selected month
-            filtered_records = [
-                record for record in self.records
-                if record.date and record.date.month == int(self.month)
-            ]
-            self.records = filtered_records
+    # -------- BUTTON METHODS --------
+    @classmethod
+    @ModelView.button
+    @Workflow.transition('draft')
+    def draft(cls, timesheets):
+        pass
+
+    @classmethod
+    @ModelView.button
+    @Workflow.transition('submitted')
+    def submit(cls, timesheets):
+        pass
+
+    @classmethod
+    @ModelView.button
+    @Workflow.transition('approved')
+    def approve(cls, timesheets):
+        pass
+
+    @classmethod
+    @ModelView.button
+    @Workflow.transition('closed')
+    def close(cls, timesheets):
+        """
+        Store the snapshot of the month, the records can no longer be changed.
+        """
+        cls.store_snapshots(timesheets)
+
+    @classmethod
+    @ModelView.button
+    def copy_previous_month(cls, timesheets):
+        """
+        Fill the days with the rows of the previous month of the same weekday.
+        """
+        cls.copy_from_previous_month(timesheets)
+
+    @classmethod
+    @ModelView.button
+    def rebuild_summary(cls, timesheets):
+        """
+        Recompute the summary from the records to fix any drift.
+        """
+        pool = Pool()
+        UserTimesheetSummary = pool.get('afx.user.timesheet.summary')
+        UserTimesheetSummary.rebuild([t.id for t in timesheets])
 
     # -------- OVERRIDE METHODS --------
     @classmethod
-    def search(cls, domain, offset=0, limit=None, order=None, count=False, query=False):
+    @instrumented('afx.user.timesheet.search')
+    def search(cls, domain, offset=0, limit=None, order=None, count=False,
+            query=False):
+        return super().search(
+            domain, offset=offset, limit=limit, order=order, count=count,
+            query=query)
+
+    @classmethod
+    @instrumented('afx.user.timesheet.create')
+    def create(cls, vlist):
+        """
+        Override the save method to add user timesheet record automatically
+        based on selected Month & Year.
+        The day rows of every created timesheet are inserted with a single
+        batched create.
+        """
+        pool = Pool()
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+        UserTimesheetSummary = pool.get('afx.user.timesheet.summary')
+        WorkingDay = pool.get('afx.timesheet.working_day')
+
+        cls.check_unique_user_year_month([(None, v) for v in vlist])
+        new_timesheets = super(UserTimesheet, cls).create(vlist)
+
+        # The later changes of the calendar do not change the month
+        WorkingDay.freeze({
+                (t.user.company.id, t.year, t.month) for t in new_timesheets})
+        to_create = []
+        deltas = {}
+        for timesheet in new_timesheets:
+            if timesheet.sparse:
+                # The default days are not stored but count in the summary
+                deltas.update(timesheet.get_default_contributions(
+                        timesheet.get_dates()))
+            else:
+                to_create.extend(timesheet._get_default_records())
+        if to_create:
+            UserTimesheetRecord.create(to_create)
+        UserTimesheetSummary.apply_deltas(deltas)
+        return new_timesheets
+
+    def _get_default_records(self):
+        """
+        Return the values of the default day rows for the timesheet month.
+        """
+        records = []
+        for date_info in self.get_dates():
+            # Prepare the data for creating a new UserTimesheetRecord
+            records.append({
+                'timesheet': self.id,           # Link to the newly created timesheet
+                **self.get_default_day(date_info),
+                })
+        return records
+
+    def get_default_day(self, date):
+        """
+        Return the values of the default day row of date.
+        The hours come from the working time of the company.
+        """
+        _, hours = self.get_working_calendar(
+            self.user.company.id, date.year, date.month)
+        time_out = (
+            datetime.datetime.combine(date, self.DAY_START)
+            + datetime.timedelta(hours=hours)).time()
+        return {
+            'date': date,                   # Date from the generated list
+            'day': None,                    # Day name derived from the date
+            'task': '',                     # No task initially
+            'project': None,                # No project initially
+            'detail': '',                   # Optional detail (use None for empty)
+            'so_no': None,                  # Optional S/O Number (use None for empty)
+            'time_in': self.DAY_START,      # Set Time In to the start of the day
+            'time_out': time_out,           # Set Time Out after the hours per work day
+            'total': hours,                 # Set Total Hours to the hours per work day
+            }
+
+    def get_default_contributions(self, dates):
+        """
+        Return the summary contributions of the default days of dates keyed
+        by (timesheet, task, project).
+        Only the working days have a default day.
+        """
+        working_dates = set(self.get_dates())
+        contributions = defaultdict(lambda: [0.0, 0])
+        for date in dates:
+            if date not in working_dates:
+                continue
+            values = self.get_default_day(date)
+            key = (self.id, values['task'] or '', values['project'])
+            contributions[key][0] += values['total'] or 0.0
+            contributions[key][1] += 1
+        return contributions
+
+    def get_dates(self):
+        """
+        Return the working dates of the timesheet month.
+        """
+        dates, _ = self.get_working_calendar(
+            self.user.company.id, int(self.year), int(self.month))
+        return list(dates)
+
+    # -------- CALENDAR METHODS --------
+    @classmethod
+    def get_working_calendar(cls, company_id, year, month):
+        """
+        Return the working dates of the month and the hours per work day of
+        the company.
+        The calendar of the months with timesheets is frozen when their
+        first timesheet is created and refrozen when the holidays or the
+        working time change while the month is open, the other months use
+        the current calendar of the company.
+        The result is cached per (company, year, month) until the holidays
+        or the working time of a company change.
+        """
+        pool = Pool()
+        WorkingDay = pool.get('afx.timesheet.working_day')
+
+        year, month = int(year), int(month)
+        key = (company_id, year, month)
+        result = cls._working_calendar_cache.get(key)
+        if result is not None:
+            return result
+
+        result = WorkingDay.get_calendar(company_id, year, month)
+        if result is None:
+            result = cls.compute_working_calendar(company_id, year, month)
+        cls._working_calendar_cache.set(key, result)
+        return result
+
+    @classmethod
+    def compute_working_calendar(cls, company_id, year, month):
         """
-        Override the search method to filter timesheet records based on the logged-in user.
-        So the logged-in user only sees timesheet records related to him/her self
+        Return the working dates of the month and the hours per work day
+        from the current working time and holidays of the company.
+        The working days of the week are deduced from the hours per work
+        week and per work day of the company, and the holidays are removed.
         """
-        # Get the logged-in user's ID
-        user_id = Transaction().user
+        pool = Pool()
+        Company = pool.get('company.company')
+        Holiday = pool.get('afx.timesheet.holiday')
+
+        company = Company(company_id)
+        hours_per_day = company.hours_per_work_day or cls.DEFAULT_HOURS
+        hours_per_week = company.hours_per_work_week or hours_per_day * 5
+        # The working days start on Monday
+        work_days = min(max(round(hours_per_week / hours_per_day), 1), 7)
 
-        # Get required models from pool to get user's group to determine search
-        # limitation
+        dates = cls.generate_dates_list(year, month)
+        holidays = {h.date for h in Holiday.search([
+                    ('company', '=', company_id),
+                    ('date', '>=', dates[0]),
+                    ('date', '<=', dates[-1]),
+                    ])}
+        return (
+            tuple(d for d in dates
+                if d.weekday() < work_days and d not in holidays),
+            hours_per_day)
+
+    # -------- SPARSE METHODS --------
+    @classmethod
+    def get_month_records(cls, timesheets, offset=0, limit=None):
+        """
+        Return for each timesheet the values of the days of its month: the
+        stored rows completed by the default working days which are not
+        stored.
+        The days off are only returned when they are stored and the default
+        days have no id.
+        The days are ordered by date and only those from offset to offset +
+        limit are returned.
+        The days of the closed timesheets are read from their snapshot.
+        """
         pool = Pool()
-        UserGroup = pool.get('res.user-res.group')
-        Group = pool.get('res.group')
-
-        current_user_groups = UserGroup.search([
-            ('user', '=', user_id)
-        ])
-
-        _is_admin = False
-        if current_user_groups:
-            for user_group in current_user_groups:
-                group = Group.search([
-                    ('id', '=', user_group.group)
-                ])
-                if group:
-                    if group[0].name == cls.ADMIN:
-                        _is_admin = True
-        
-        if _is_admin == False:
-            # Add a condition to filter projects where the user is involved
-            domain = [
-                ('OR',
-                    [('user', '=', user_id)],
-                ),
-                # *domain  # Preserve any existing domain conditions
-            ]
+        UserTimesheetDay = pool.get('afx.user.timesheet.day')
+
+        names = cls.MONTH_RECORD_FIELDS
+        snapshots = cls.get_snapshots(timesheets)
+        # The records of archived timesheets are archived too
+        domain = [('active', 'in', [True, False])]
+        order = [('date', 'ASC'), ('id', 'ASC')]
+        paged = offset or limit is not None
+        stored = defaultdict(list)
+        if paged:
+            # The page is selected by the query of each timesheet
+            days = (
+                UserTimesheetDay.search_read(
+                    [('timesheet', '=', t.id)] + domain,
+                    offset=offset, limit=limit, order=order,
+                    fields_names=names + ['timesheet'])
+                for t in timesheets if t.id not in snapshots)
         else:
-            domain = []
+            days = (
+                UserTimesheetDay.search_read(
+                    [('timesheet', 'in', [t.id for t in sub_timesheets])]
+                    + domain,
+                    order=order, fields_names=names + ['timesheet'])
+                for sub_timesheets in grouped_slice(
+                    [t for t in timesheets if t.id not in snapshots]))
+        for day in chain.from_iterable(days):
+            if day['id'] >= UserTimesheetDay.VIRTUAL_ID:
+                day['id'] = None
+            stored[day['timesheet']].append({n: day[n] for n in names})
+
+        end = offset + limit if limit is not None else None
+        result = []
+        for timesheet in timesheets:
+            if timesheet.id in snapshots:
+                result.append(snapshots[timesheet.id]['days'][offset:end])
+            else:
+                result.append(stored[timesheet.id])
+        return result
+
+    def materialize_days(self, dates):
+        """
+        Return the day rows of dates, storing the default rows of the dates
+        which are not yet stored.
+        """
+        pool = Pool()
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+
+        records = {r.date: r for r in UserTimesheetRecord.search([
+                    ('timesheet', '=', self.id),
+                    ('date', 'in', list(dates)),
+                    ])}
+        to_create = [
+            {'timesheet': self.id, **self.get_default_day(d)}
+            for d in sorted(set(dates) - set(records))]
+        if to_create:
+            records.update(
+                (r.date, r) for r in UserTimesheetRecord.create(to_create))
+        return [records[d] for d in dates]
+
+    @classmethod
+    @instrumented('afx.user.timesheet.write')
+    def write(cls, *args):
+        pool = Pool()
+        ProjectHours = pool.get('afx.user.timesheet.project_hours')
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+        record = UserTimesheetRecord.__table__()
+        cursor = Transaction().connection.cursor()
+
+        actions = iter(args)
+        to_edit, to_activate, to_check = [], {}, []
+        for timesheets, values in zip(actions, actions):
+            # The workflow and the archiving do not change the month
+            if values.keys() - {'active', 'state', 'snapshot'}:
+                to_edit.extend(t.id for t in timesheets)
+            if 'active' in values:
+                to_activate.update(
+                    (t.id, bool(values['active'])) for t in timesheets)
+            if values.keys() & {'user', 'year', 'month'}:
+                to_check.extend((t, values) for t in timesheets)
+        cls.check_editable(to_edit)
+        cls.check_unique_user_year_month(to_check)
+
+        super(UserTimesheet, cls).write(*args)
+
+        # The records are archived and restored with their timesheet
+        for active in [True, False]:
+            timesheet_ids = [
+                i for i, a in to_activate.items() if a == active]
+            for sub_ids in grouped_slice(timesheet_ids):
+                cursor.execute(*record.update(
+                        [record.active], [active],
+                        where=reduce_ids(record.timesheet, sub_ids)))
+        if to_activate:
+            ProjectHours._month_cache.clear()
 
-        return super(UserTimesheet, cls).search(domain, offset=offset, limit=limit, order=order, count=count, query=query)
-    
     @classmethod
-    def create(cls, record):
+    def check_unique_user_year_month(cls, to_check):
         """
-        Override the save method to add user timesheet record automatically
-        based on selected Month & Year
-        """
-        data = record[0]
-        year = int(data.get('year', None))
-        month = int(data.get('month', None))
-
-        new_timesheet = super(UserTimesheet,cls).create(record)
-        if new_timesheet:  # Ensure the list is not empty
-            timesheet_id = new_timesheet[0].id  # Access the first record's ID
-            for date_info in cls.generate_dates_list(year, month):
-                pool = Pool()
-                UserTimesheetRecord = pool.get('afx.user.timesheet.record')
-                # Prepare the data for creating a new UserTimesheetRecord
-                random_data = os.urandom(16)
-                unique_id = cls.UUID_PREFIX + hashlib.sha256(random_data).hexdigest()
-                record_data = {
-                    'unique_id': unique_id,         # Create unique_id
-                    'timesheet': timesheet_id,      # Link to the newly created timesheet
-                    'date': date_info,              # Date from the generated list
-                    'day': None,                    # Day name derived from the date
-                    'task': '',                     # No task initially
-                    'project': None,                # No project initially
-                    'detail': '',                   # Optional detail (use None for empty)
-                    'so_no': None,                  # Optional S/O Number (use None for empty)
-                    'time_in': time(9, 0),          # Set Time In to 9:00 AM
-                    'time_out': time(17, 0),        # Set Time Out to 5:00 PM
-                    'total': 8.0,                   # Set Total Hours to 8.0
+        Raise an error if a timesheet of the (timesheet, values) pairs has
+        the user, year and month of another timesheet.
+        The timesheet is None for the values to create. The existing
+        timesheets are read with one query per slice of users.
+        """
+        pool = Pool()
+        Employee = pool.get('company.employee')
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+
+        keys = {}
+        for timesheet, values in to_check:
+            if timesheet is not None:
+                values = {
+                    'user': timesheet.user.id,
+                    'year': timesheet.year,
+                    'month': timesheet.month,
+                    **values,
+                    }
+            if None in (values.get('user'), values.get('year'),
+                    values.get('month')):
+                continue
+            key = (
+                int(values['user']), str(values['year']),
+                str(values['month']))
+            # The values of the same batch are duplicated as well
+            if key in keys:
+                cls._raise_duplicate(Employee(key[0]), *key[1:])
+            keys[key] = timesheet.id if timesheet is not None else None
+
+        for sub_users in grouped_slice(list({k[0] for k in keys})):
+            cursor.execute(*table.select(
+                    table.id, table.user, table.year, table.month,
+                    where=table.user.in_(list(sub_users))))
+            for id_, user_id, year, month in cursor:
+                key = (user_id, year, month)
+                if key in keys and keys[key] != id_:
+                    cls._raise_duplicate(Employee(user_id), year, month)
+
+    @staticmethod
+    def _raise_duplicate(employee, year, month):
+        raise UserError(
+            "Duplicate Entry",
+            f"A timesheet for user '{employee.rec_name}' already exists "
+            f"for the year {year} and month {month}.")
+
+    # -------- EDIT METHODS --------
+    @classmethod
+    def edit_days(cls, timesheets, values, from_date=None, to_date=None,
+            weekdays=None):
+        """
+        Apply the values to the day rows of the timesheets between from_date
+        and to_date whose weekday (0 is Monday) is in weekdays.
+        The targeted days are the working days and the stored days, the
+        working days not yet stored are stored first.
+        The on_change_task rule is applied and the totals are recomputed, then
+        all the rows are updated with one write, so the summary and the
+        project tasks are updated once for the whole batch.
+        Only the task, project, detail, time_in and time_out can be edited.
+        """
+        pool = Pool()
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+        Project = pool.get('afx.project')
+
+        names = ['task', 'project', 'detail', 'time_in', 'time_out']
+        unknown = set(values) - set(names)
+        if unknown:
+            raise UserError(
+                "Invalid Fields",
+                f"The fields {', '.join(sorted(unknown))} can not be edited "
+                "in bulk.")
+        if values.get('project') is not None:
+            project = Project(values['project'])
+            so_no = project.so_no
+        else:
+            so_no = None
+
+        def selected(date):
+            return ((from_date is None or date >= from_date)
+                and (to_date is None or date <= to_date)
+                and (weekdays is None or date.weekday() in weekdays))
+
+        records = []
+        for timesheet in timesheets:
+            stored = {r.date: r for r in UserTimesheetRecord.search([
+                        ('timesheet', '=', timesheet.id),
+                        ])}
+            missing = [
+                d for d in timesheet.get_dates()
+                if selected(d) and d not in stored]
+            if missing:
+                stored.update(
+                    zip(missing, timesheet.materialize_days(missing)))
+            records.extend(
+                r for d, r in sorted(stored.items()) if selected(d))
+
+        # Group the rows sharing the same values into one write action
+        grouped = {}
+        for record in records:
+            record_values = {
+                'task': record.task,
+                'project': record.project.id if record.project else None,
+                'detail': record.detail,
+                'time_in': record.time_in,
+                'time_out': record.time_out,
+                **values,
                 }
-                # Create the UserTimesheetRecord
-                UserTimesheetRecord.create([record_data])
-        return new_timesheet
-    
+            if 'project' in values:
+                record_values['so_no'] = so_no
+            record_values = UserTimesheetRecord.clean_task_values(
+                record_values)
+            if record_values['task'] == 'IN_PROJECT':
+                record_values['total'] = (
+                    UserTimesheetRecord.compute_total_hours(
+                        record_values['time_in'], record_values['time_out']))
+            key = tuple(sorted(record_values.items()))
+            grouped.setdefault(key, []).append(record)
+        args = []
+        for key, sub_records in grouped.items():
+            args.extend((sub_records, dict(key)))
+        if args:
+            UserTimesheetRecord.write(*args)
+        return records
+
+    # -------- COPY METHODS --------
     @classmethod
-    def validate(cls, timesheets):
-        super(UserTimesheet, cls).validate(timesheets)
+    def copy_from_previous_month(cls, timesheets):
+        """
+        Copy on the working days of the timesheets the status, project,
+        detail and times of the previous month timesheet of the same user.
+        Each day gets the values of the last stored working day of the
+        previous month with the same weekday, the weekdays without such a
+        day are left untouched. The leave days are not copied as they are
+        not a pattern of the work.
+        The rows sharing the same pattern are copied by one write, so the
+        times are checked, the summary is updated and the project tasks are
+        synchronised once for the whole batch.
+        """
+        pool = Pool()
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+
+        cls.check_editable([t.id for t in timesheets])
+        names = [
+            'task', 'project', 'detail', 'so_no', 'time_in', 'time_out',
+            'total']
+        grouped = defaultdict(list)
         for timesheet in timesheets:
-            cls.check_unique_user_year_month(timesheet)
+            first_day = datetime.date(int(timesheet.year), int(timesheet.month), 1)
+            previous_day = first_day - datetime.timedelta(days=1)
+            previous = cls.search([
+                    ('user', '=', timesheet.user.id),
+                    ('year', '=', str(previous_day.year)),
+                    ('month', '=', str(previous_day.month)),
+                    ('active', 'in', [True, False]),
+                    ], limit=1)
+            if not previous:
+                continue
+            previous, = previous
+
+            # The last stored working day of each weekday which is not a
+            # leave is the pattern
+            previous_dates = set(previous.get_dates())
+            patterns = {}
+            for values in UserTimesheetRecord.search_read([
+                        ('timesheet', '=', previous.id),
+                        ('active', 'in', [True, False]),
+                        ], order=[('date', 'ASC'), ('id', 'ASC')],
+                    fields_names=names + ['date']):
+                if (values['date'] in previous_dates
+                        and not (values['task'] or '').startswith('LEAVE_')):
+                    patterns[values['date'].weekday()] = tuple(
+                        (n, values[n]) for n in names)
+
+            dates = [d for d in timesheet.get_dates() if d.weekday() in patterns]
+            if not dates:
+                continue
+            # The days not yet stored are stored before being copied
+            for record in timesheet.materialize_days(dates):
+                grouped[patterns[record.date.weekday()]].append(record)
+
+        args = []
+        for key, records in grouped.items():
+            args.extend((records, dict(key)))
+        if not args:
+            return []
+        UserTimesheetRecord.write(*args)
+        return [r for records in args[::2] for r in records]
 
+    # -------- ARCHIVE METHODS --------
     @classmethod
-    def check_unique_user_year_month(cls, timesheet):
-        existing = cls.search([
-            ('user', '=', timesheet.user.id),
-            ('year', '=', timesheet.year),
-            ('month', '=', timesheet.month),
-            ('id', '!=', timesheet.id),  # Exclude the current record if editing
-        ], limit=1)
-        if existing:
-            raise UserError(
-                "Duplicate Entry",
-                f"A timesheet for user '{timesheet.user.name}' already exists "
-                f"for the year {timesheet.year} and month {timesheet.month}."
-            )
+    def check_editable(cls, timesheet_ids):
+        """
+        Raise an error if any of the timesheets is archived or closed.
+        """
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+        for sub_ids in grouped_slice(timesheet_ids):
+            cursor.execute(*table.select(
+                    table.id, table.state,
+                    where=reduce_ids(table.id, sub_ids)
+                    & ((table.active == Literal(False))
+                        | (table.state == 'closed')),
+                    limit=1))
+            row = cursor.fetchone()
+            if row:
+                timesheet = cls(row[0])
+                if row[1] == 'closed':
+                    raise UserError(
+                        "Closed Timesheet",
+                        f"The timesheet of '{timesheet.user.rec_name}' for "
+                        f"{timesheet.month}/{timesheet.year} is closed and "
+                        "can not be modified.")
+                raise UserError(
+                    "Archived Timesheet",
+                    f"The timesheet of '{timesheet.user.rec_name}' for "
+                    f"{timesheet.month}/{timesheet.year} is archived and can "
+                    "not be modified.")
+
+    @classmethod
+    def archive(cls, year=None, month=None):
+        """
+        Archive the timesheets and their records of the months before the
+        month, by default the months older than the archive period of the
+        configuration.
+        The archived rows are read-only and excluded from the default
+        searches and reports. The timesheets are archived by chunks with one
+        UPDATE per table.
+        """
+        pool = Pool()
+        Configuration = pool.get('afx.timesheet.configuration')
+        ProjectHours = pool.get('afx.user.timesheet.project_hours')
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+        table = cls.__table__()
+        record = UserTimesheetRecord.__table__()
+        cursor = Transaction().connection.cursor()
+
+        if year is None or month is None:
+            months = Configuration(1).archive_after_months
+            if not months:
+                return 0
+            today = datetime.date.today()
+            index = today.year * 12 + today.month - 1 - months
+            year, month = index // 12, index % 12 + 1
+
+        # The year and month are stored as strings, the years of 4 digits
+        before = table.year < str(year)
+        if month > 1:
+            before |= ((table.year == str(year))
+                & table.month.in_([str(m) for m in range(1, month)]))
+        cursor.execute(*table.select(
+                table.id,
+                where=(table.active == Literal(True)) & before))
+        timesheet_ids = [i for i, in cursor]
+        for sub_ids in grouped_slice(timesheet_ids):
+            sub_ids = list(sub_ids)
+            cursor.execute(*table.update(
+                    [table.active], [False],
+                    where=reduce_ids(table.id, sub_ids)))
+            cursor.execute(*record.update(
+                    [record.active], [False],
+                    where=reduce_ids(record.timesheet, sub_ids)))
+        if timesheet_ids:
+            ProjectHours._month_cache.clear()
+        logger.info(
+            "Archived %s timesheets before %s/%s",
+            len(timesheet_ids), year, month)
+        return len(timesheet_ids)
+
+    # -------- CLOSING METHODS --------
+    @classmethod
+    def store_snapshots(cls, timesheets):
+        """
+        Store on the timesheets the snapshot of their month.
+        The snapshot is a JSON document with the days as arrays of the
+        MONTH_RECORD_FIELDS values and the (project, so_no, days, hours)
+        split of the month. The dates and times are stored in ISO format.
+        """
+        args = []
+        for timesheet, days in zip(
+                timesheets, cls.get_month_records(timesheets)):
+            projects = {}
+            for values in days:
+                if values['project'] is None:
+                    continue
+                split = projects.setdefault(
+                    (values['project'], values['so_no']), [0, 0.0])
+                split[0] += 1
+                split[1] += values['total'] or 0.0
+            snapshot = {
+                'days': [
+                    [v.isoformat() if isinstance(v, (datetime.date, time))
+                        else v
+                        for v in (d[n] for n in cls.MONTH_RECORD_FIELDS)]
+                    for d in days],
+                'projects': [
+                    [p, s, d, h] for (p, s), (d, h) in projects.items()],
+                }
+            args.extend(([timesheet], {
+                        'snapshot': json.dumps(
+                            snapshot, separators=(',', ':')),
+                        }))
+        if args:
+            cls.write(*args)
+
+    @classmethod
+    def get_snapshots(cls, timesheets):
+        """
+        Return the decoded snapshot of the closed timesheets keyed by id.
+        The days are returned as dictionaries like get_month_records.
+        """
+        names = cls.MONTH_RECORD_FIELDS
+        date_index = names.index('date')
+        time_indexes = [names.index('time_in'), names.index('time_out')]
+
+        closed = [t.id for t in timesheets if t.state == 'closed']
+        snapshots = {}
+        for values in cls.read(closed, ['snapshot']):
+            if not values['snapshot']:
+                continue
+            snapshot = json.loads(values['snapshot'])
+            days = []
+            for day in snapshot['days']:
+                day[date_index] = datetime.date.fromisoformat(day[date_index])
+                for index in time_indexes:
+                    if day[index]:
+                        day[index] = time.fromisoformat(day[index])
+                days.append(dict(zip(names, day)))
+            snapshot['days'] = days
+            snapshots[values['id']] = snapshot
+        return snapshots
+
+    # -------- GRID METHODS --------
+    @classmethod
+    def get_month_grid(cls, company, year, month, supervisor=None):
+        """
+        Return the days of the month of the employees of the company, or
+        only of the subordinates of the supervisor, which the user can read.
+        The result has the dates of the month and for each employee with a
+        timesheet the [id, name, tasks, hours] where tasks and hours are the
+        task codes and the total hours of each date.
+        The records of the same date are added up and their distinct task
+        codes are joined by a comma.
+        The days which are not stored are None, except the working days of
+        the sparse timesheets which get the default day.
+        """
+        pool = Pool()
+        Employee = pool.get('company.employee')
+        Party = pool.get('party.party')
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+        timesheet = cls.__table__()
+        record = UserTimesheetRecord.__table__()
+        employee = Employee.__table__()
+        party = Party.__table__()
+        cursor = Transaction().connection.cursor()
+
+        year, month = int(year), int(month)
+        dates = cls.generate_dates_list(year, month)
+        columns = {d: i for i, d in enumerate(dates)}
+        working_dates, hours_per_day = cls.get_working_calendar(
+            company, year, month)
+
+        # The access and the rules of the user select the timesheets
+        domain = [
+            ('user.company', '=', company),
+            ('year', '=', str(year)),
+            ('month', '=', str(month)),
+            ('active', 'in', [True, False]),
+            ]
+        if supervisor is not None:
+            domain.append(('user.supervisor', '=', supervisor))
+        timesheet_ids = [t.id for t in cls.search(domain)]
+
+        rows = []
+        for sub_ids in grouped_slice(timesheet_ids):
+            cursor.execute(*timesheet.join(
+                    employee, condition=timesheet.user == employee.id
+                    ).join(party, condition=employee.party == party.id
+                    ).join(record, 'LEFT',
+                    condition=record.timesheet == timesheet.id
+                    ).select(
+                        timesheet.user, party.name, timesheet.sparse,
+                        record.date, record.task, record.total,
+                        where=reduce_ids(timesheet.id, sub_ids)))
+            rows.extend(cursor)
+        rows.sort(key=lambda r: (r[1] or '', r[0], str(r[3] or '')))
+
+        employees = []
+        last = None
+        for employee_id, name, sparse, date, task, total in rows:
+            if employee_id != last:
+                tasks = [None] * len(dates)
+                hours = [None] * len(dates)
+                if sparse:
+                    for working_date in working_dates:
+                        tasks[columns[working_date]] = ''
+                        hours[columns[working_date]] = hours_per_day
+                employees.append([employee_id, name, tasks, hours])
+                stored = set()
+                last = employee_id
+            if date is None:
+                continue
+            if isinstance(date, str):
+                date = datetime.date.fromisoformat(date)
+            if date not in columns:
+                continue
+            column = columns[date]
+            task = task or ''
+            # The first stored record replaces the default day
+            if column not in stored:
+                stored.add(column)
+                tasks[column] = task
+                hours[column] = total
+            else:
+                if task not in tasks[column].split(','):
+                    tasks[column] = ','.join(
+                        t for t in [tasks[column], task] if t)
+                hours[column] = (hours[column] or 0) + (total or 0)
+        return {
+            'dates': dates,
+            'employees': employees,
+            }
+
+    # -------- PROVISIONING METHODS --------
+    @classmethod
+    def provision(cls, year=None, month=None):
+        """
+        Create the timesheets and their day rows of the month, by default
+        the next month, for every active employee of MAIN_COMPANY which has
+        none yet.
+        The employees are processed by chunks each committed in its own
+        transaction, so no long transaction holds the locks and a failed or
+        interrupted run is resumed by running it again.
+        """
+        pool = Pool()
+        Employee = pool.get('company.employee')
+        table = cls.__table__()
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+
+        if year is None or month is None:
+            today = datetime.date.today()
+            next_month = (
+                today.replace(day=1) + datetime.timedelta(days=32))
+            year, month = next_month.year, next_month.month
+        year, month = str(year), str(month)
+
+        with transaction.set_context(
+                date=datetime.date(int(year), int(month), 1)):
+            employees = Employee.search([
+                    ('company', '=', cls.MAIN_COMPANY),
+                    ], order=[('id', 'ASC')])
+        cursor.execute(*table.select(
+                table.user,
+                where=(table.year == year) & (table.month == month)))
+        existing = {u for u, in cursor}
+        employee_ids = [e.id for e in employees if e.id not in existing]
+
+        created = 0
+        for sub_ids in grouped_slice(employee_ids, cls.PROVISION_CHUNK_SIZE):
+            sub_ids = list(sub_ids)
+            try:
+                with transaction.new_transaction() as new_transaction:
+                    cls.create([{
+                                'user': employee_id,
+                                'year': year,
+                                'month': month,
+                                } for employee_id in sub_ids])
+                    new_transaction.commit()
+                created += len(sub_ids)
+            except Exception:
+                # The remaining chunks are still processed, the failed one
+                # is retried by the next run
+                logger.exception(
+                    "Failed to provision the timesheets %s/%s of employees %s",
+                    year, month, sub_ids)
+        logger.info(
+            "Provisioned %s timesheets for %s/%s, %s already existed",
+            created, year, month, len(existing))
+        return created
 
     # -------- UTIL METHODS --------'    
     @staticmethod
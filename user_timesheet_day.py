@@ -0,0 +1,215 @@
+from trytond.model import DeactivableMixin, ModelSQL, ModelView, fields
+from trytond.pool import Pool
+from trytond.transaction import Transaction
+from trytond.exceptions import UserError
+from trytond.tools import grouped_slice, reduce_ids
+from sql import Literal, Null, Union
+from sql.functions import Extract
+from collections import defaultdict
+import datetime
+
+class UserTimesheetDay(DeactivableMixin, ModelSQL, ModelView):
+    "Timesheet Day"
+    __name__ = 'afx.user.timesheet.day'
+
+    # The default days which are not stored get an id above VIRTUAL_ID made
+    # of the timesheet id and the day of the month
+    VIRTUAL_ID = 10 ** 12
+
+    unique_id = fields.Char("Uuid", size=32, readonly=True)
+    timesheet = fields.Many2One('afx.user.timesheet', "Timesheet")
+    date = fields.Date("Date", required=True)
+    day = fields.Char("Day")
+    task = fields.Selection([], "Status", sort=False)
+    project = fields.Many2One('afx.project', "Project", domain=[
+        ('so_no', '!=', None)
+    ])
+    detail = fields.Text("Detail")
+    so_no = fields.Char(
+        "S/O Number",
+        help="The S/O Number of the project.",
+        on_change_with=['project']
+    )
+    time_in = fields.Time("Time In", help="Format: HH:MM")
+    time_out = fields.Time('Time Out', help='Format: HH:MM')
+    total = fields.Float(
+        'Total Hours', digits=(16, 2),
+        help="Calculated total hours spent from Time In to Time Out.")
+
+    @classmethod
+    def __setup__(cls):
+        pool = Pool()
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+        super().__setup__()
+        cls.task.selection = UserTimesheetRecord._task_get()
+
+    @classmethod
+    def table_query(cls):
+        """
+        Return the stored records completed by the default working days of
+        the sparse timesheets which are not stored.
+        """
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+        Employee = pool.get('company.employee')
+        WorkingDay = pool.get('afx.timesheet.working_day')
+        transaction = Transaction()
+        record = UserTimesheetRecord.__table__()
+        stored = UserTimesheetRecord.__table__()
+        timesheet = UserTimesheet.__table__()
+        employee = Employee.__table__()
+        working_day = WorkingDay.__table__()
+        integer = transaction.database.sql_type('INTEGER').base
+
+        columns = [
+            'create_uid', 'create_date', 'write_uid', 'write_date',
+            'unique_id', 'timesheet', 'date', 'day', 'task', 'project',
+            'detail', 'so_no', 'time_in', 'time_out', 'total', 'active']
+        records = record.select(
+            record.id.as_('id'),
+            *(getattr(record, c).as_(c) for c in columns))
+
+        where = ((timesheet.sparse == Literal(True))
+            & (Extract('YEAR', working_day.date).cast(integer)
+                == timesheet.year.cast(integer))
+            & (Extract('MONTH', working_day.date).cast(integer)
+                == timesheet.month.cast(integer))
+            & (stored.id == Null))
+        timesheet_ids = transaction.context.get('_timesheet_day_timesheets')
+        if timesheet_ids is not None:
+            where &= reduce_ids(timesheet.id, timesheet_ids)
+        defaults = timesheet.join(
+            employee, condition=timesheet.user == employee.id
+            ).join(working_day,
+            condition=working_day.company == employee.company
+            ).join(stored, 'LEFT',
+            condition=(stored.timesheet == timesheet.id)
+            & (stored.date == working_day.date)
+            ).select(
+                (Literal(cls.VIRTUAL_ID) + timesheet.id * Literal(100)
+                    + Extract('DAY', working_day.date).cast(integer)
+                    ).as_('id'),
+                timesheet.create_uid.as_('create_uid'),
+                timesheet.create_date.as_('create_date'),
+                Literal(None).as_('write_uid'),
+                Literal(None).as_('write_date'),
+                Literal(None).as_('unique_id'),
+                timesheet.id.as_('timesheet'),
+                working_day.date.as_('date'),
+                Literal(None).as_('day'),
+                Literal('').as_('task'),
+                Literal(None).as_('project'),
+                Literal('').as_('detail'),
+                Literal(None).as_('so_no'),
+                working_day.time_in.as_('time_in'),
+                working_day.time_out.as_('time_out'),
+                working_day.hours.as_('total'),
+                timesheet.active.as_('active'),
+                where=where)
+        return Union(records, defaults, all_=True)
+
+    @classmethod
+    def _decode_id(cls, id_):
+        "Return the timesheet id and the day of the month of a default day"
+        return divmod(id_ - cls.VIRTUAL_ID, 100)
+
+    @classmethod
+    def read(cls, ids, fields_names):
+        # Only the default days of the timesheets of ids are computed
+        timesheet_ids = {
+            cls._decode_id(i)[0] for i in ids if i >= cls.VIRTUAL_ID}
+        with Transaction().set_context(
+                _timesheet_day_timesheets=sorted(timesheet_ids)):
+            return super().read(ids, fields_names)
+
+    # -------- ONCHANGE METHOD --------
+    @fields.depends('task', 'project', 'detail', 'so_no', 'time_in', 'time_out', 'total')
+    def on_change_task(self):
+        """
+        When the task is changed, if it is not 'IN_PROJECT', empty and disable all fields.
+        """
+        pool = Pool()
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+        if self.task != 'IN_PROJECT':
+            for name, value in UserTimesheetRecord.clean_task_values(
+                    {'task': self.task}).items():
+                setattr(self, name, value)
+
+    @fields.depends('project')
+    def on_change_with_so_no(self, name=None):
+        if self.project and self.project.so_no:
+            return self.project.so_no
+        return None
+
+    @fields.depends('time_in', 'time_out')
+    def on_change_time_in(self):
+        self.calculate_total_hours()
+
+    @fields.depends('time_in', 'time_out')
+    def on_change_time_out(self):
+        self.calculate_total_hours()
+
+    def calculate_total_hours(self):
+        pool = Pool()
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+        self.total = UserTimesheetRecord.compute_total_hours(
+            self.time_in, self.time_out)
+
+    # -------- OVERRIDE METHODS --------
+    @classmethod
+    def get_records(cls, days):
+        """
+        Return the timesheet records of the days, storing first the default
+        days which are not stored.
+        """
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+
+        record_ids = {}
+        dates = defaultdict(list)
+        for day in days:
+            if day.id >= cls.VIRTUAL_ID:
+                timesheet_id, _ = cls._decode_id(day.id)
+                dates[timesheet_id].append(day.id)
+            else:
+                record_ids[day.id] = day.id
+        for timesheet in UserTimesheet.browse(list(dates)):
+            ids = dates[timesheet.id]
+            records = timesheet.materialize_days([
+                    datetime.date(
+                        int(timesheet.year), int(timesheet.month),
+                        cls._decode_id(i)[1])
+                    for i in ids])
+            record_ids.update(zip(ids, (r.id for r in records)))
+        return UserTimesheetRecord.browse([record_ids[d.id] for d in days])
+
+    @classmethod
+    def create(cls, vlist):
+        pool = Pool()
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+        records = UserTimesheetRecord.create(vlist)
+        return cls.browse([r.id for r in records])
+
+    @classmethod
+    def write(cls, *args):
+        pool = Pool()
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+        actions = iter(args)
+        record_args = []
+        for days, values in zip(actions, actions):
+            record_args.extend((cls.get_records(days), values))
+        UserTimesheetRecord.write(*record_args)
+
+    @classmethod
+    def delete(cls, days):
+        pool = Pool()
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+        if any(d.id >= cls.VIRTUAL_ID for d in days):
+            raise UserError(
+                "Default Day",
+                "The default days can not be deleted, change their status "
+                "instead.")
+        for sub_ids in grouped_slice([d.id for d in days]):
+            UserTimesheetRecord.delete(UserTimesheetRecord.browse(sub_ids))
@@ -0,0 +1,195 @@
+from trytond.model import ModelSQL, ModelView, fields
+from trytond.pool import Pool
+from trytond.transaction import Transaction
+from trytond.cache import Cache
+from trytond.rpc import RPC
+from sql import Literal, Null
+from sql.aggregate import Count, Min, Sum
+from sql.conditionals import Coalesce
+from sql.functions import CurrentTimestamp, Extract
+import datetime
+import calendar
+
+class ProjectHours(ModelSQL, ModelView):
+    "Timesheet Project Hours"
+    __name__ = 'afx.user.timesheet.project_hours'
+
+    project = fields.Many2One('afx.project', "Project", readonly=True)
+    so_no = fields.Char("S/O Number", readonly=True)
+    year = fields.Integer("Year", readonly=True)
+    month = fields.Integer("Month", readonly=True)
+    employee = fields.Many2One('company.employee', "Employee", readonly=True)
+    days = fields.Integer("Days", readonly=True)
+    hours = fields.Float("Hours", digits=(16, 2), readonly=True)
+
+    _month_cache = Cache(__name__ + '.get_month_hours', context=False)
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        cls._order = [
+            ('year', 'DESC'),
+            ('month', 'DESC'),
+            ('so_no', 'ASC'),
+            ('project', 'ASC'),
+            ('employee', 'ASC'),
+            ]
+        cls.__rpc__.update({
+                'get_month_hours': RPC(),
+                'get_so_hours': RPC(),
+                })
+
+    @classmethod
+    def table_query(cls):
+        """
+        Group the records by project, S/O number, month and employee in a
+        single query, restricted to the dates of the context.
+        The archived records are only included on request of the context.
+        """
+        context = Transaction().context
+        record, timesheet = cls._get_tables()
+        where = record.project != Null
+        if context.get('from_date'):
+            where &= record.date >= context['from_date']
+        if context.get('to_date'):
+            where &= record.date <= context['to_date']
+        if context.get('project'):
+            where &= record.project == context['project']
+        if not context.get('include_archived'):
+            where &= record.active == Literal(True)
+        year = Extract('YEAR', record.date)
+        month = Extract('MONTH', record.date)
+        return record.join(
+            timesheet, condition=record.timesheet == timesheet.id
+            ).select(
+                Min(record.id).as_('id'),
+                Literal(0).as_('create_uid'),
+                CurrentTimestamp().as_('create_date'),
+                cls.write_uid.sql_cast(Literal(Null)).as_('write_uid'),
+                cls.write_date.sql_cast(Literal(Null)).as_('write_date'),
+                record.project.as_('project'),
+                record.so_no.as_('so_no'),
+                year.as_('year'),
+                month.as_('month'),
+                timesheet.user.as_('employee'),
+                Count(Literal('*')).as_('days'),
+                Sum(Coalesce(record.total, 0)).as_('hours'),
+                where=where,
+                group_by=[
+                    record.project, record.so_no, year, month,
+                    timesheet.user])
+
+    @classmethod
+    def _get_tables(cls):
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+        return UserTimesheetRecord.__table__(), UserTimesheet.__table__()
+
+    # -------- REPORT METHODS --------
+    @classmethod
+    def get_month_hours(cls, year, month):
+        """
+        Return the (project, so_no, employee, days, hours) of the month.
+        The hours of the closed timesheets are read from their snapshot.
+        The archived records are only included on request of the context,
+        as for the table query.
+        The result of closed months, i.e. before the current month, is
+        cached until a record of a closed month is changed or archived.
+        """
+        pool = Pool()
+        ModelAccess = pool.get('ir.model.access')
+        UserTimesheet = pool.get('afx.user.timesheet')
+        ModelAccess.check(cls.__name__, 'read')
+
+        include_archived = bool(
+            Transaction().context.get('include_archived'))
+        today = datetime.date.today()
+        closed = (year, month) < (today.year, today.month)
+        key = (Transaction().database.name, year, month, include_archived)
+        if closed:
+            result = cls._month_cache.get(key)
+            if result is not None:
+                return result
+
+        record, timesheet = cls._get_tables()
+        cursor = Transaction().connection.cursor()
+        start_date = datetime.date(year, month, 1)
+        end_date = datetime.date(
+            year, month, calendar.monthrange(year, month)[1])
+        where = ((record.project != Null)
+            & (record.date >= start_date)
+            & (record.date <= end_date)
+            & (timesheet.state != 'closed'))
+        if not include_archived:
+            where &= record.active == Literal(True)
+        cursor.execute(*record.join(
+                timesheet, condition=record.timesheet == timesheet.id
+                ).select(
+                    record.project, record.so_no, timesheet.user,
+                    Count(Literal('*')), Sum(Coalesce(record.total, 0)),
+                    where=where,
+                    group_by=[record.project, record.so_no, timesheet.user]))
+        hours = {(p, s, u): [d, h] for p, s, u, d, h in cursor}
+
+        where = ((timesheet.year == str(year))
+            & (timesheet.month == str(month))
+            & (timesheet.state == 'closed'))
+        if not include_archived:
+            where &= timesheet.active == Literal(True)
+        cursor.execute(*timesheet.select(timesheet.id, where=where))
+        timesheets = UserTimesheet.browse([i for i, in cursor])
+        snapshots = UserTimesheet.get_snapshots(timesheets)
+        for sheet in timesheets:
+            if sheet.id not in snapshots:
+                continue
+            for project, so_no, days, month_hours in (
+                    snapshots[sheet.id]['projects']):
+                total = hours.setdefault(
+                    (project, so_no, sheet.user.id), [0, 0])
+                total[0] += days
+                total[1] += month_hours
+        result = tuple((*k, *v) for k, v in hours.items())
+        if closed:
+            cls._month_cache.set(key, result)
+        return result
+
+    @classmethod
+    def get_so_hours(cls, year, months):
+        """
+        Return the hours per S/O number over the months of the year, e.g.
+        the months of a quarter.
+        """
+        hours = {}
+        for month in months:
+            for _, so_no, _, _, month_hours in cls.get_month_hours(
+                    year, month):
+                hours[so_no] = hours.get(so_no, 0) + month_hours
+        return hours
+
+    @classmethod
+    def clear_closed_months(cls, dates):
+        """
+        Invalidate the cached months if any of the dates is in a closed
+        month.
+        """
+        first_day = datetime.date.today().replace(day=1)
+        if any(d and d < first_day for d in dates):
+            cls._month_cache.clear()
+
+
+class ProjectHoursContext(ModelView):
+    "Timesheet Project Hours Context"
+    __name__ = 'afx.user.timesheet.project_hours.context'
+
+    from_date = fields.Date("From Date")
+    to_date = fields.Date("To Date")
+    project = fields.Many2One('afx.project', "Project")
+    include_archived = fields.Boolean(
+        "Include Archived", help="Include the archived months.")
+
+    @classmethod
+    def default_from_date(cls):
+        # Default to the current quarter
+        today = datetime.date.today()
+        return datetime.date(today.year, 3 * ((today.month - 1) // 3) + 1, 1)
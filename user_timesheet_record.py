@@ -1,15 +1,31 @@
-from trytond.model import ModelSQL, ModelView, fields
-from datetime import time, datetime, timedelta
+from trytond.model import DeactivableMixin, Index, ModelSQL, ModelView, fields
 from trytond.pool import Pool
+from trytond.transaction import Transaction
+from trytond.exceptions import UserError
+from trytond.rpc import RPC
+from trytond.tools import grouped_slice, reduce_ids
+from trytond import backend
+from .instrumentation import instrumented
+from datetime import time, datetime, timedelta
+from sql import Literal, Null
+from sql.conditionals import Coalesce
+from sql.functions import Substring
+from collections import defaultdict
+import csv
+import gzip
+import heapq
+import io
 import logging
+import os
+import uuid
 
 logger = logging.getLogger(__name__)
 
-class UserTimesheetRecord(ModelSQL, ModelView):
+class UserTimesheetRecord(DeactivableMixin, ModelSQL, ModelView):
     "Timesheet Record"
     __name__ = 'afx.user.timesheet.record'
 
-    unique_id = fields.Char("Uuid")
+    unique_id = fields.Char("Uuid", size=32, readonly=True)
     timesheet = fields.Many2One('afx.user.timesheet', "Timesheet")
     date = fields.Date("Date", required=True)
     day = fields.Char("Day")
@@ -20,7 +36,7 @@ class UserTimesheetRecord(ModelSQL, ModelView):
     detail = fields.Text("Detail")
     so_no = fields.Char(
         "S/O Number",
-        help="Automatically filled based on the selected project.",
+        help="The S/O Number of the project.",
         on_change_with=['project']  # Trigger computation when project changes
     )
     time_in = fields.Time(
@@ -41,6 +57,66 @@ class UserTimesheetRecord(ModelSQL, ModelView):
     def __setup__(cls):
         super().__setup__()
         cls.task.selection = cls._task_get()
+        cls.__rpc__.update({
+                'get_changes': RPC(),
+                })
+
+        t = cls.__table__()
+        cls._sql_indexes.update({
+                Index(t, (t.unique_id, Index.Equality())),
+                # Used by the change feed
+                Index(
+                    t,
+                    (Coalesce(t.write_date, t.create_date), Index.Range()),
+                    (t.id, Index.Range())),
+                Index(
+                    t,
+                    (t.timesheet, Index.Range()),
+                    (t.date, Index.Range())),
+                # The default searches only touch the records not archived
+                Index(
+                    t, (t.date, Index.Range()),
+                    where=t.active == Literal(True)),
+                Index(t, (t.so_no, Index.Equality())),
+                })
+
+    @classmethod
+    def __register__(cls, module_name):
+        pool = Pool()
+        Project = pool.get('afx.project')
+        ProjectTask = pool.get('afx.project.task')
+        UserTimesheet = pool.get('afx.user.timesheet')
+        cursor = Transaction().connection.cursor()
+
+        # Migration from 7.4: shorten "tsr_" + sha256 unique_id to 32 hex
+        # digits, on both sides of the join with the project tasks
+        for Model in [cls, ProjectTask]:
+            if backend.TableHandler.table_exist(Model._table):
+                table = Model.__table__()
+                cursor.execute(*table.update(
+                        [table.unique_id],
+                        [Substring(table.unique_id, 5, 32)],
+                        where=table.unique_id.like('tsr_%')))
+
+        super().__register__(module_name)
+
+        # Migration from 7.4: refresh the stale S/O Number of the records of
+        # the open timesheets, the projects keep them in sync since
+        if (backend.TableHandler.table_exist(Project._table)
+                and backend.TableHandler(Project).column_exist('so_no')):
+            table = cls.__table__()
+            project = Project.__table__()
+            timesheet = UserTimesheet.__table__()
+            so_no = project.select(
+                project.so_no, where=project.id == table.project)
+            cursor.execute(*table.update(
+                    [table.so_no], [so_no],
+                    where=(table.project != Null)
+                    & (Coalesce(table.so_no, '') != Coalesce(so_no, ''))
+                    & table.timesheet.in_(timesheet.select(
+                            timesheet.id,
+                            where=(timesheet.active == Literal(True))
+                            & (timesheet.state != 'closed')))))
 
     def _task_get():
         tasks = [
@@ -89,6 +165,24 @@ class UserTimesheetRecord(ModelSQL, ModelView):
             self.time_out = None
             self.total = None
 
+    @staticmethod
+    def clean_task_values(values):
+        """
+        Apply to the values the on_change_task rule: when the task is not
+        'IN_PROJECT' all the other fields are emptied.
+        """
+        values = values.copy()
+        if values.get('task') != 'IN_PROJECT':
+            values.update({
+                    'project': None,
+                    'detail': None,
+                    'so_no': None,
+                    'time_in': None,
+                    'time_out': None,
+                    'total': None,
+                    })
+        return values
+
     @fields.depends('project')  # Declare dependency on the 'project' field
     def on_change_with_so_no(self, name=None):
         """
@@ -117,11 +211,18 @@ class UserTimesheetRecord(ModelSQL, ModelView):
         """
         Calculate the total hours spent from time_in to time_out.
         """
-        if self.time_in and self.time_out:
+        self.total = self.compute_total_hours(self.time_in, self.time_out)
+
+    @staticmethod
+    def compute_total_hours(time_in, time_out):
+        """
+        Return the total hours spent from time_in to time_out.
+        """
+        if time_in and time_out:
             # Convert time_in and time_out to datetime objects for easier manipulation
             today = datetime.today().date()
-            time_in_dt = datetime.combine(today, self.time_in)
-            time_out_dt = datetime.combine(today, self.time_out)
+            time_in_dt = datetime.combine(today, time_in)
+            time_out_dt = datetime.combine(today, time_out)
 
             # Handle cases where time_out is on the next day (e.g., working past midnight)
             if time_out_dt < time_in_dt:
@@ -133,101 +234,785 @@ class UserTimesheetRecord(ModelSQL, ModelView):
             total_hours = total_seconds / 3600  # Convert seconds to hours
 
             # Round to two decimal places
-            self.total = round(total_hours, 2)
+            return round(total_hours, 2)
         else:
-            self.total = 0.0  # Reset total if either time_in or time_out is mis
+            return 0.0  # Reset total if either time_in or time_out is mis
+
+    @staticmethod
+    def generate_unique_ids(count):
+        """
+        Return count new unique_id as UUID hex strings.
+        The random bytes of all the identifiers are read at once.
+        """
+        random_data = os.urandom(16 * count)
+        return [
+            uuid.UUID(bytes=random_data[i:i + 16], version=4).hex
+            for i in range(0, 16 * count, 16)]
 
     # -------- OVERRIDE METHODS --------
     @classmethod
+    @instrumented('afx.user.timesheet.record.create')
+    def create(cls, vlist):
+        """
+        Override the create method to give a unique_id to the new records and
+        to synchronise those created with a project.
+        """
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+        UserTimesheetSummary = pool.get('afx.user.timesheet.summary')
+        ProjectHours = pool.get('afx.user.timesheet.project_hours')
+
+        UserTimesheet.check_editable(
+            {v['timesheet'] for v in vlist if v.get('timesheet')})
+        vlist = cls._fill_so_no([v.copy() for v in vlist])
+        missing = [v for v in vlist if not v.get('unique_id')]
+        for values, unique_id in zip(
+                missing, cls.generate_unique_ids(len(missing))):
+            values['unique_id'] = unique_id
+
+        records = super(UserTimesheetRecord, cls).create(vlist)
+        ids = [r.id for r in records]
+
+        ProjectHours.clear_closed_months([r.date for r in records])
+        deltas = cls._get_summary_contributions(ids)
+        # The first record of a date of sparse timesheets replaces its
+        # default day
+        for key, (hours, days) in cls._get_sparse_contributions(
+                [], cls._get_sparse_keys(ids), ids).items():
+            deltas[key][0] += hours
+            deltas[key][1] += days
+        UserTimesheetSummary.apply_deltas(deltas)
+
+        cls._schedule_project_sync([r for r in records if r.project])
+        return records
+
+    @classmethod
+    @instrumented('afx.user.timesheet.record.write')
     def write(cls, records, values, *args):
         """
         Override the write method to handle creation of ProjectMember and ProjectTask records.
         """
         pool = Pool()
-        ProjectMember = pool.get('afx.project.member')
-        ProjectTask = pool.get('afx.project.task')
+        UserTimesheet = pool.get('afx.user.timesheet')
+        UserTimesheetSummary = pool.get('afx.user.timesheet.summary')
+        ProjectHours = pool.get('afx.user.timesheet.project_hours')
+
+        actions = iter((records, values) + args)
+        all_records = []
+        summary_ids = []
+        moved_ids = []
+        for sub_records, sub_values in zip(actions, actions):
+            all_records.extend(sub_records)
+            if cls._summary_fields & sub_values.keys():
+                summary_ids.extend(r.id for r in sub_records)
+            if {'timesheet', 'date'} & sub_values.keys():
+                moved_ids.extend(r.id for r in sub_records)
+        UserTimesheet.check_editable(
+            {r.timesheet.id for r in all_records if r.timesheet}
+            | {v['timesheet'] for v in (values,) + args[1::2]
+                if v.get('timesheet')})
+        old_contributions = cls._get_summary_contributions(summary_ids)
+        old_keys = cls._get_sparse_keys(moved_ids)
+        dates = [r.date for r in all_records]
+
+        # The S/O Number follows the project
+        args = list((records, values) + args)
+        args[1::2] = cls._fill_so_no([v.copy() for v in args[1::2]])
 
         # Call the super method to ensure the write operation is performed
-        super(UserTimesheetRecord, cls).write(records, values, *args)
+        super(UserTimesheetRecord, cls).write(*args)
 
-        for record in records:
-            if record.unique_id:
-                # Check if the 'project' field has been updated and has a value
-                if record.project:
-                    project_id = record.project
-                    # Get the user from the timesheet field
-                    user = record.timesheet.user if record.timesheet else None
-                    if not user:
-                        logger.warning("No user found for timesheet record")
-                        continue
+        ProjectHours.clear_closed_months(
+            dates + [r.date for r in all_records])
 
-                    # Step 1: Check if a ProjectMember record already exists for the user and project
-                    existing_project_member = ProjectMember.search([
-                        ('project', '=', project_id),
-                        ('member', '=', user.id),
-                    ])
-                    if existing_project_member:
-                        # Use the existing ProjectMember record
-                        project_member = existing_project_member[0]
-                    else:
-                        # Create a new ProjectMember record
-                        project_member_values = {
-                            'project': project_id,
-                            'member': user.id,
-                            'role': 'Default Role',  # You can adjust this as needed
-                            'rate': 0,  # Default rate, adjust as needed
-                            'est_start_date': record.date,  # Use the date from the timesheet record
-                            'est_end_date': record.date,  # Use the same date for simplicity
-                        }
-                        project_member, = ProjectMember.create([project_member_values])
-
-                    # Step 2: Check if a ProjectTask record with the same unique_id already exists
-                    try:
-                        project_task = None
-                        existing_project_task = ProjectTask.search([
-                            ('unique_id', '=', record.unique_id)
-                        ])
-                        if existing_project_task:
-                            # Update the existing ProjectTask record
-                            project_task = existing_project_task[0]  # Assign the existing record to project_task
-                            project_task_values = {
-                                'project': project_id,
-                                'activity': record.detail,
-                                'pic': project_member.id,
-                                'start_time': record.time_in,
-                                'end_time': record.time_out,
-                                'total_hours': record.total,
-                                'priority': 'medium',
-                                'status': 'to_do',
-                            }
-                            ProjectTask.write([project_task], project_task_values)
-                        if not existing_project_task:
-                            # Create a new ProjectTask record
-                            project_task_values = {
-                                'unique_id': record.unique_id,
-                                'project': project_id,
-                                'activity': record.detail,
-                                'pic': project_member.id,
-                                'start_time': record.time_in,
-                                'end_time': record.time_out,
-                                'total_hours': record.total,
-                                'priority': 'medium',
-                                'status': 'to_do',
-                            }
-                            project_task, = ProjectTask.create([project_task_values])  # Assign the newly created record to project_task
-                            # Ensure project_task is always defined before proceeding
-                            if 'project_task' not in locals():
-                                logger.error(f"Failed to create or update ProjectTask for record {record.id}")
-                                continue
-                    except Exception as e:
-                        # Log the exception and continue processing other records
-                        logger.error(f"An error occurred while processing record {record.id}: {str(e)}")
+        deltas = cls._get_summary_contributions(summary_ids)
+        for key, (hours, days) in old_contributions.items():
+            deltas[key][0] -= hours
+            deltas[key][1] -= days
+        # The moved records of sparse timesheets free or replace default days
+        new_keys = cls._get_sparse_keys(moved_ids)
+        for key, (hours, days) in cls._get_sparse_contributions(
+                old_keys - new_keys, new_keys - old_keys,
+                moved_ids).items():
+            deltas[key][0] += hours
+            deltas[key][1] += days
+        UserTimesheetSummary.apply_deltas(deltas)
+
+        cls._schedule_project_sync(all_records)
+
+    @classmethod
+    def _fill_so_no(cls, vlist):
+        """
+        Set in the values which change the project the S/O Number of the
+        project, the projects are read with one query.
+        """
+        pool = Pool()
+        Project = pool.get('afx.project')
+
+        project_ids = {
+            v['project'] for v in vlist if v.get('project') is not None}
+        so_nos = {}
+        if project_ids:
+            so_nos = {
+                p['id']: p['so_no']
+                for p in Project.read(list(project_ids), ['so_no'])}
+        for values in vlist:
+            if 'project' in values:
+                values['so_no'] = so_nos.get(values['project'])
+        return vlist
+
+    @classmethod
+    def delete(cls, records):
+        pool = Pool()
+        UserTimesheetSummary = pool.get('afx.user.timesheet.summary')
+        UserTimesheet = pool.get('afx.user.timesheet')
+        Tombstone = pool.get('afx.user.timesheet.record.tombstone')
+        ProjectHours = pool.get('afx.user.timesheet.project_hours')
+
+        UserTimesheet.check_editable(
+            {r.timesheet.id for r in records if r.timesheet})
+        ids = [r.id for r in records]
+        deltas = cls._get_summary_contributions(ids)
+        keys = cls._get_sparse_keys(ids)
+        ProjectHours.clear_closed_months([r.date for r in records])
+
+        Tombstone.bury(ids)
+        super(UserTimesheetRecord, cls).delete(records)
+
+        deltas = defaultdict(lambda: [0.0, 0], {
+                k: [-hours, -days] for k, (hours, days) in deltas.items()})
+        # The last record of a date of sparse timesheets falls back to its
+        # default day
+        for key, (hours, days) in cls._get_sparse_contributions(
+                keys, [], ids).items():
+            deltas[key][0] += hours
+            deltas[key][1] += days
+        UserTimesheetSummary.apply_deltas(deltas)
+
+    # -------- VALIDATION METHODS --------
+    @classmethod
+    def validate(cls, records):
+        super().validate(records)
+        cls.check_times(records)
+
+    @classmethod
+    def check_times(cls, records):
+        """
+        Check that the time intervals of the records do not overlap the other
+        records of the employee and that the total hours of the employee per
+        day do not exceed the daily cap of the configuration.
+        A time out before the time in ends on the next day.
+        The records of all the employees and dates of the batch, with the
+        days around to catch the overnight intervals, are read with one
+        query and all the violations are reported together.
+        """
+        pool = Pool()
+        Configuration = pool.get('afx.timesheet.configuration')
+        UserTimesheet = pool.get('afx.user.timesheet')
+        Employee = pool.get('company.employee')
+        record = cls.__table__()
+        timesheet = UserTimesheet.__table__()
+        cursor = Transaction().connection.cursor()
+
+        records = [r for r in records if r.timesheet and r.date]
+        if not records:
+            return
+        max_daily_hours = Configuration(1).max_daily_hours
+        checked = {r.id for r in records}
+        employee_ids = {r.timesheet.user.id for r in records}
+        dates = {r.date for r in records}
+
+        cursor.execute(*record.join(
+                timesheet, condition=record.timesheet == timesheet.id
+                ).select(
+                    record.id, timesheet.user, record.date, record.time_in,
+                    record.time_out, record.total,
+                    where=reduce_ids(timesheet.user, list(employee_ids))
+                    & (record.date >= min(dates) - timedelta(days=1))
+                    & (record.date <= max(dates) + timedelta(days=1))))
+        intervals = defaultdict(list)
+        totals = defaultdict(float)
+        for id_, employee_id, date, time_in, time_out, total in cursor:
+            if isinstance(date, str):
+                date = datetime.strptime(date, '%Y-%m-%d').date()
+            if isinstance(time_in, str):
+                time_in = time.fromisoformat(time_in)
+            if isinstance(time_out, str):
+                time_out = time.fromisoformat(time_out)
+            totals[(employee_id, date)] += total or 0.0
+            if time_in and time_out:
+                start = datetime.combine(date, time_in)
+                end = datetime.combine(date, time_out)
+                if end < start:
+                    end += timedelta(days=1)
+                intervals[employee_id].append((start, end, id_, date))
+
+        errors = []
+        for employee_id, employee_intervals in intervals.items():
+            employee_intervals.sort()
+            end, end_id, end_date = None, None, None
+            for start, stop, id_, date in employee_intervals:
+                if (end is not None and start < end
+                        and (id_ in checked or end_id in checked)):
+                    errors.append(
+                        f"{Employee(employee_id).rec_name}: the times of "
+                        f"{date} overlap those of {end_date}.")
+                if end is None or stop > end:
+                    end, end_id, end_date = stop, id_, date
+        if max_daily_hours:
+            for (employee_id, date), total in sorted(totals.items()):
+                if date in dates and total > max_daily_hours:
+                    errors.append(
+                        f"{Employee(employee_id).rec_name}: {total:.2f} hours "
+                        f"on {date} exceed the daily cap of "
+                        f"{max_daily_hours:.2f} hours.")
+        if errors:
+            raise UserError("Invalid Times", "\n".join(errors))
+
+    # -------- SUMMARY METHODS --------
+    _summary_fields = {'timesheet', 'task', 'project', 'total'}
+
+    @classmethod
+    def _get_summary_contributions(cls, ids):
+        """
+        Return the hours and days of the records keyed by
+        (timesheet, task, project) as stored in the database.
+        """
+        contributions = defaultdict(lambda: [0.0, 0])
+        for sub_ids in grouped_slice(ids):
+            for row in cls.read(list(sub_ids), list(cls._summary_fields)):
+                if not row['timesheet']:
+                    continue
+                key = (row['timesheet'], row['task'] or '', row['project'])
+                contributions[key][0] += row['total'] or 0.0
+                contributions[key][1] += 1
+        return contributions
+
+    # -------- EXPORT METHODS --------
+    EXPORT_CHUNK_SIZE = 1000
+    EXPORT_HEADER = [
+        'Date', 'Employee', 'Status', 'Project', 'S/O Number', 'Detail',
+        'Time In', 'Time Out', 'Total Hours']
+
+    @classmethod
+    def export_rows(cls, from_date, to_date):
+        """
+        Yield the CSV rows of the records between from_date and to_date with
+        the employee and project names.
+        The archived records are only included when the context has
+        include_archived.
+        The records are fetched by chunks ordered by (date, id) using the
+        last row of the previous chunk as start, so the memory used does not
+        depend on the number of records. The default days of the sparse
+        timesheets are merged after the stored rows of their date.
+        """
+        # The default days of sparse timesheets are not stored
+        return heapq.merge(
+            cls._export_stored_rows(from_date, to_date),
+            cls._export_default_rows(from_date, to_date),
+            key=lambda row: row[0])
+
+    @classmethod
+    def _export_stored_rows(cls, from_date, to_date):
+        """
+        Yield the CSV rows of the stored records between from_date and
+        to_date in (date, id) order.
+        """
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+        Employee = pool.get('company.employee')
+        Party = pool.get('party.party')
+        Project = pool.get('afx.project')
+        record = cls.__table__()
+        timesheet = UserTimesheet.__table__()
+        employee = Employee.__table__()
+        party = Party.__table__()
+        cursor = Transaction().connection.cursor()
+
+        project_names = {}
+        where = (record.date >= from_date) & (record.date <= to_date)
+        if not Transaction().context.get('include_archived'):
+            where &= record.active == Literal(True)
+        last = None
+        while True:
+            chunk_where = where
+            if last:
+                last_date, last_id = last
+                chunk_where &= ((record.date > last_date)
+                    | ((record.date == last_date) & (record.id > last_id)))
+            cursor.execute(*record.join(
+                    timesheet, 'LEFT',
+                    condition=record.timesheet == timesheet.id
+                    ).join(employee, 'LEFT',
+                    condition=timesheet.user == employee.id
+                    ).join(party, 'LEFT',
+                    condition=employee.party == party.id
+                    ).select(
+                        record.id, record.date, party.name, record.task,
+                        record.project, record.so_no, record.detail,
+                        record.time_in, record.time_out, record.total,
+                        where=chunk_where,
+                        order_by=[record.date.asc, record.id.asc],
+                        limit=cls.EXPORT_CHUNK_SIZE))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            project_ids = {r[4] for r in rows
+                if r[4] is not None and r[4] not in project_names}
+            if project_ids:
+                project_names.update(
+                    (p.id, p.rec_name) for p in Project.browse(project_ids))
+            for (id_, date, employee_name, task, project_id, so_no, detail,
+                    time_in, time_out, total) in rows:
+                if isinstance(date, str):
+                    date = datetime.strptime(date, '%Y-%m-%d').date()
+                yield [
+                    date, employee_name, task or '',
+                    project_names.get(project_id, ''), so_no or '',
+                    detail or '', time_in or '', time_out or '',
+                    total if total is not None else '']
+            last = rows[-1][1], rows[-1][0]
+
+    @classmethod
+    def _export_default_rows(cls, from_date, to_date):
+        """
+        Yield the CSV rows of the default days between from_date and to_date
+        of the sparse timesheets in date order.
+        For each date, the sparse timesheets of its month without a stored
+        record on the date are fetched by chunks.
+        """
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+        Employee = pool.get('company.employee')
+        Party = pool.get('party.party')
+        record = cls.__table__()
+        timesheet = UserTimesheet.__table__()
+        employee = Employee.__table__()
+        party = Party.__table__()
+        cursor = Transaction().connection.cursor()
+
+        where = timesheet.sparse == Literal(True)
+        if not Transaction().context.get('include_archived'):
+            where &= timesheet.active == Literal(True)
+        date = from_date
+        while date <= to_date:
+            date_where = (where
+                & (timesheet.year == str(date.year))
+                & (timesheet.month == str(date.month))
+                & (record.id == Null))
+            last_id = 0
+            while True:
+                cursor.execute(*timesheet.join(employee, 'LEFT',
+                        condition=timesheet.user == employee.id
+                        ).join(party, 'LEFT',
+                        condition=employee.party == party.id
+                        ).join(record, 'LEFT',
+                        condition=(record.timesheet == timesheet.id)
+                        & (record.date == date)
+                        ).select(
+                            timesheet.id, party.name,
+                            where=date_where & (timesheet.id > last_id),
+                            order_by=[timesheet.id.asc],
+                            limit=cls.EXPORT_CHUNK_SIZE))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                employee_names = dict(rows)
+                for sheet in UserTimesheet.browse(list(employee_names)):
+                    if date not in sheet.get_dates():
                         continue
-                else:
-                    existing_project_task = ProjectTask.search([
-                        ('unique_id', '=', record.unique_id)
-                    ])
-                    if existing_project_task:
-                        ProjectTask.delete(existing_project_task)
-
-        return True
\ No newline at end of file
+                    values = sheet.get_default_day(date)
+                    yield [
+                        date, employee_names[sheet.id], values['task'] or '',
+                        '', values['so_no'] or '', values['detail'] or '',
+                        values['time_in'] or '', values['time_out'] or '',
+                        values['total'] if values['total'] is not None
+                        else '']
+                last_id = rows[-1][0]
+            date += timedelta(days=1)
+
+    @classmethod
+    def export_csv(cls, file, from_date, to_date, compress=False):
+        """
+        Write the CSV export of the records between from_date and to_date
+        into the binary file, gzip compressed if compress is set.
+        """
+        if compress:
+            file = gzip.GzipFile(fileobj=file, mode='wb')
+        try:
+            text = io.TextIOWrapper(file, encoding='utf-8', newline='')
+            writer = csv.writer(text)
+            writer.writerow(cls.EXPORT_HEADER)
+            for row in cls.export_rows(from_date, to_date):
+                writer.writerow(row)
+            text.flush()
+            text.detach()
+        finally:
+            if compress:
+                file.close()
+
+    @classmethod
+    def _get_sparse_keys(cls, ids):
+        """
+        Return the (timesheet, date) of the records which belong to sparse
+        timesheets.
+        """
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+        record = cls.__table__()
+        timesheet = UserTimesheet.__table__()
+        cursor = Transaction().connection.cursor()
+
+        keys = set()
+        for sub_ids in grouped_slice(ids):
+            cursor.execute(*record.join(
+                    timesheet, condition=record.timesheet == timesheet.id
+                    ).select(
+                    record.timesheet, record.date,
+                    where=reduce_ids(record.id, sub_ids)
+                    & (timesheet.sparse == Literal(True))))
+            for timesheet_id, date in cursor:
+                if isinstance(date, str):
+                    date = datetime.strptime(date, '%Y-%m-%d').date()
+                keys.add((timesheet_id, date))
+        return keys
+
+    @classmethod
+    def _get_sparse_contributions(cls, freed, taken, ids):
+        """
+        Return the contributions of the default days of the freed
+        (timesheet, date) minus those of the taken ones.
+        The dates which have other records than ids are skipped as their
+        default day is replaced anyway.
+        """
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+        record = cls.__table__()
+        cursor = Transaction().connection.cursor()
+
+        contributions = defaultdict(lambda: [0.0, 0])
+        keys = set(freed) | set(taken)
+        if not keys:
+            return contributions
+        ids = set(ids)
+        dates = defaultdict(set)
+        for timesheet_id, date in keys:
+            dates[timesheet_id].add(date)
+        others = set()
+        for timesheet_id, timesheet_dates in dates.items():
+            cursor.execute(*record.select(
+                    record.id, record.date,
+                    where=(record.timesheet == timesheet_id)
+                    & record.date.in_(sorted(timesheet_dates))))
+            for id_, date in cursor:
+                if id_ in ids:
+                    continue
+                if isinstance(date, str):
+                    date = datetime.strptime(date, '%Y-%m-%d').date()
+                others.add((timesheet_id, date))
+
+        for sign, sign_keys in [(1, freed), (-1, taken)]:
+            sign_dates = defaultdict(list)
+            for timesheet_id, date in set(sign_keys) - others:
+                sign_dates[timesheet_id].append(date)
+            for timesheet in UserTimesheet.browse(list(sign_dates)):
+                for key, (hours, days) in (
+                        timesheet.get_default_contributions(
+                            sign_dates[timesheet.id]).items()):
+                    contributions[key][0] += sign * hours
+                    contributions[key][1] += sign * days
+        return contributions
+
+    # -------- CHANGE FEED METHODS --------
+    CHANGES_PAGE_SIZE = 1000
+    # The changes of running transactions may be committed with an earlier
+    # timestamp, so the most recent changes are only returned after a delay
+    CHANGES_DELAY = timedelta(minutes=5)
+    CHANGES_FIELDS = [
+        'id', 'unique_id', 'timesheet', 'employee', 'date', 'task',
+        'project', 'so_no', 'detail', 'time_in', 'time_out', 'total']
+
+    @classmethod
+    def get_changes(cls, cursor=None, limit=None):
+        """
+        Return a page of the records created or modified and of the records
+        deleted since the cursor, as a dictionary with:
+            fields: the names of the values of the changed rows
+            changed: the values of the created or modified records
+            deleted: the (id, unique_id) of the deleted records
+            cursor: the cursor to get the next page
+            more: whether there are more changes
+        Without cursor, all the records are returned.
+        The records are paged by (write or create date, id) and the deletions
+        by (date, id) of the tombstone, both using an index.
+        When the access is checked, only the changes of the timesheets that
+        the user can read are returned.
+        """
+        pool = Pool()
+        ModelAccess = pool.get('ir.model.access')
+        UserTimesheet = pool.get('afx.user.timesheet')
+        Tombstone = pool.get('afx.user.timesheet.record.tombstone')
+        record = cls.__table__()
+        timesheet = UserTimesheet.__table__()
+        tombstone = Tombstone.__table__()
+        transaction = Transaction()
+        sql_cursor = transaction.connection.cursor()
+        ModelAccess.check(cls.__name__, 'read')
+        if transaction.check_access:
+            visible = UserTimesheet.search([
+                    ('active', 'in', [True, False]),
+                    ], order=[], query=True)
+        else:
+            visible = None
+
+        limit = min(limit or cls.CHANGES_PAGE_SIZE, cls.CHANGES_PAGE_SIZE)
+        changed_last, deleted_last = cls._parse_changes_cursor(cursor)
+        until = datetime.now() - cls.CHANGES_DELAY
+
+        changed_at = Coalesce(record.write_date, record.create_date)
+        where = changed_at < until
+        if changed_last:
+            last_at, last_id = changed_last
+            where &= ((changed_at > last_at)
+                | ((changed_at == last_at) & (record.id > last_id)))
+        if visible is not None:
+            where &= record.timesheet.in_(visible)
+        sql_cursor.execute(*record.join(
+                timesheet, 'LEFT',
+                condition=record.timesheet == timesheet.id
+                ).select(
+                    changed_at, record.id, record.unique_id, record.timesheet,
+                    timesheet.user, record.date, record.task, record.project,
+                    record.so_no, record.detail, record.time_in,
+                    record.time_out, record.total,
+                    where=where,
+                    order_by=[changed_at.asc, record.id.asc],
+                    limit=limit + 1))
+        changed = sql_cursor.fetchall()
+        more = len(changed) > limit
+        changed = changed[:limit]
+        if changed:
+            changed_last = cls._parse_timestamp(changed[-1][0]), changed[-1][1]
+
+        where = tombstone.create_date < until
+        if deleted_last:
+            last_at, last_id = deleted_last
+            where &= ((tombstone.create_date > last_at)
+                | ((tombstone.create_date == last_at)
+                    & (tombstone.id > last_id)))
+        if visible is not None:
+            where &= tombstone.timesheet.in_(visible)
+        sql_cursor.execute(*tombstone.select(
+                tombstone.create_date, tombstone.id, tombstone.record,
+                tombstone.unique_id,
+                where=where,
+                order_by=[tombstone.create_date.asc, tombstone.id.asc],
+                limit=limit + 1))
+        deleted = sql_cursor.fetchall()
+        more |= len(deleted) > limit
+        deleted = deleted[:limit]
+        if deleted:
+            deleted_last = cls._parse_timestamp(deleted[-1][0]), deleted[-1][1]
+
+        return {
+            'fields': cls.CHANGES_FIELDS,
+            'changed': [
+                cls._format_change(list(row[1:])) for row in changed],
+            'deleted': [[row[2], row[3]] for row in deleted],
+            'cursor': cls._format_changes_cursor(changed_last, deleted_last),
+            'more': more,
+            }
+
+    @classmethod
+    def _format_change(cls, row):
+        """
+        Convert the date and times of the changed row which some backends
+        return as strings.
+        """
+        date_index = cls.CHANGES_FIELDS.index('date')
+        if isinstance(row[date_index], str):
+            row[date_index] = datetime.strptime(
+                row[date_index], '%Y-%m-%d').date()
+        for name in ['time_in', 'time_out']:
+            index = cls.CHANGES_FIELDS.index(name)
+            if isinstance(row[index], str):
+                row[index] = time.fromisoformat(row[index])
+        return row
+
+    @staticmethod
+    def _parse_timestamp(value):
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        return value
+
+    @staticmethod
+    def _format_changes_cursor(changed_last, deleted_last):
+        """
+        Return the cursor as "changed date,changed id,deleted date,deleted id"
+        """
+        parts = []
+        for last in [changed_last, deleted_last]:
+            if last:
+                parts.extend([last[0].isoformat(), str(last[1])])
+            else:
+                parts.extend(['', ''])
+        return ','.join(parts)
+
+    @classmethod
+    def _parse_changes_cursor(cls, cursor):
+        """
+        Return the last (date, id) of the changed and of the deleted records
+        from the cursor.
+        """
+        if not cursor:
+            return None, None
+        try:
+            changed_at, changed_id, deleted_at, deleted_id = cursor.split(',')
+            changed_last = deleted_last = None
+            if changed_at:
+                changed_last = (
+                    datetime.fromisoformat(changed_at), int(changed_id))
+            if deleted_at:
+                deleted_last = (
+                    datetime.fromisoformat(deleted_at), int(deleted_id))
+        except ValueError:
+            raise UserError(
+                "Invalid Cursor", f"The cursor '{cursor}' is invalid.")
+        return changed_last, deleted_last
+
+    # -------- SYNC METHODS --------
+    @classmethod
+    def _schedule_project_sync(cls, records):
+        """
+        Synchronise the project of the records now or queue them depending
+        on the configuration.
+        """
+        pool = Pool()
+        Configuration = pool.get('afx.timesheet.configuration')
+        UserTimesheetRecordSync = pool.get('afx.user.timesheet.record.sync')
+
+        if not records:
+            return
+        if Configuration(1).project_sync_mode == 'deferred':
+            # Only queue the records, the scheduled task synchronises them
+            UserTimesheetRecordSync.enqueue(records)
+        else:
+            try:
+                cls.sync_project_tasks(records)
+            except Exception as e:
+                # Log the exception, the timesheet records are already saved
+                logger.error(
+                    "An error occurred while synchronising records %s: %s",
+                    [r.id for r in records], e)
+
+    @classmethod
+    @instrumented('afx.user.timesheet.record.sync_project_tasks')
+    def sync_project_tasks(cls, records):
+        """
+        Synchronise the ProjectMember and ProjectTask records of the timesheet
+        records as a set operation: the existing members and tasks of the
+        whole batch are loaded with one query each, then created, written
+        and deleted in bulk.
+        The synchronisation is idempotent.
+        """
+        pool = Pool()
+        ProjectMember = pool.get('afx.project.member')
+        ProjectTask = pool.get('afx.project.task')
+
+        to_sync, to_clear = [], []
+        for record in records:
+            if not record.unique_id:
+                continue
+            if record.project:
+                # Get the user from the timesheet field
+                user = record.timesheet.user if record.timesheet else None
+                if not user:
+                    logger.warning(
+                        "No user found for timesheet record %s", record.id)
+                    continue
+                to_sync.append(record)
+            else:
+                to_clear.append(record)
+
+        # Step 1: Get or create the ProjectMember of each (project, user)
+        project_members = {}
+        if to_sync:
+            project_ids = {r.project.id for r in to_sync}
+            user_ids = {r.timesheet.user.id for r in to_sync}
+            for project_member in ProjectMember.search([
+                        ('project', 'in', list(project_ids)),
+                        ('member', 'in', list(user_ids)),
+                        ]):
+                key = (project_member.project.id, project_member.member.id)
+                project_members.setdefault(key, project_member)
+
+            to_create = {}
+            for record in to_sync:
+                key = (record.project.id, record.timesheet.user.id)
+                if key in project_members or key in to_create:
+                    continue
+                to_create[key] = {
+                    'project': key[0],
+                    'member': key[1],
+                    'role': 'Default Role',  # You can adjust this as needed
+                    'rate': 0,  # Default rate, adjust as needed
+                    'est_start_date': record.date,  # Use the date from the timesheet record
+                    'est_end_date': record.date,  # Use the same date for simplicity
+                    }
+            if to_create:
+                project_members.update(zip(
+                        to_create.keys(),
+                        ProjectMember.create(list(to_create.values()))))
+
+        # Step 2: Create, update or delete the ProjectTask sharing the unique_id
+        unique_ids = [r.unique_id for r in to_sync + to_clear]
+        project_tasks = {}
+        if unique_ids:
+            for project_task in ProjectTask.search([
+                        ('unique_id', 'in', unique_ids),
+                        ]):
+                project_tasks.setdefault(
+                    project_task.unique_id, []).append(project_task)
+
+        to_create, to_write, to_delete = [], {}, []
+        for record in to_sync:
+            project_member = project_members[
+                (record.project.id, record.timesheet.user.id)]
+            project_task_values = {
+                'project': record.project.id,
+                'activity': record.detail,
+                'pic': project_member.id,
+                'start_time': record.time_in,
+                'end_time': record.time_out,
+                'total_hours': record.total,
+                'priority': 'medium',
+                'status': 'to_do',
+                }
+            existing_project_task = project_tasks.get(record.unique_id)
+            if existing_project_task:
+                project_task = existing_project_task[0]
+                # Only the changed values are written, grouped by values
+                changes = {}
+                for name, value in project_task_values.items():
+                    current = getattr(project_task, name)
+                    # The Many2One are compared by id
+                    if getattr(current, 'id', current) != value:
+                        changes[name] = value
+                if changes:
+                    key = tuple(sorted(changes.items()))
+                    to_write.setdefault(key, []).append(project_task)
+            else:
+                project_task_values['unique_id'] = record.unique_id
+                to_create.append(project_task_values)
+        for record in to_clear:
+            to_delete.extend(project_tasks.get(record.unique_id, []))
+
+        if to_delete:
+            ProjectTask.delete(to_delete)
+        if to_write:
+            args = []
+            for key, tasks in to_write.items():
+                args.extend((tasks, dict(key)))
+            ProjectTask.write(*args)
+        if to_create:
+            ProjectTask.create(to_create)
@@ -0,0 +1,93 @@
+from trytond.model import ModelView, fields
+from trytond.wizard import Button, StateTransition, StateView, Wizard
+from trytond.pool import Pool
+from trytond.pyson import Eval, If
+import datetime
+import calendar
+import logging
+
+logger = logging.getLogger(__name__)
+
+class EditStart(ModelView):
+    "Edit Timesheet Records"
+    __name__ = 'afx.user.timesheet.record.edit.start'
+
+    from_date = fields.Date("From Date", required=True)
+    to_date = fields.Date("To Date", required=True, domain=[
+        If(Eval('from_date'), ('to_date', '>=', Eval('from_date')), ()),
+    ])
+    weekdays = fields.MultiSelection([
+            ('0', "Monday"),
+            ('1', "Tuesday"),
+            ('2', "Wednesday"),
+            ('3', "Thursday"),
+            ('4', "Friday"),
+            ('5', "Saturday"),
+            ('6', "Sunday"),
+            ], "Weekdays", sort=False,
+        help="Leave empty to edit every day of the range.")
+    task = fields.Selection('get_tasks', "Status", sort=False, required=True)
+    project = fields.Many2One('afx.project', "Project", domain=[
+        ('so_no', '!=', None)
+    ], states={
+        'invisible': Eval('task') != 'IN_PROJECT',
+    })
+    detail = fields.Text("Detail", states={
+        'invisible': Eval('task') != 'IN_PROJECT',
+    })
+    time_in = fields.Time("Time In", states={
+        'invisible': Eval('task') != 'IN_PROJECT',
+    }, help="Leave empty to keep the time of each day.")
+    time_out = fields.Time("Time Out", states={
+        'invisible': Eval('task') != 'IN_PROJECT',
+    }, help="Leave empty to keep the time of each day.")
+
+    @classmethod
+    def get_tasks(cls):
+        pool = Pool()
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+        return UserTimesheetRecord._task_get()
+
+
+class Edit(Wizard):
+    "Edit Timesheet Records"
+    __name__ = 'afx.user.timesheet.record.edit'
+
+    start = StateView('afx.user.timesheet.record.edit.start',
+        'afx_timesheet.user_timesheet_record_edit_start_view_form', [
+            Button('Cancel', 'end', 'tryton-cancel'),
+            Button('Edit', 'edit', 'tryton-ok', default=True),
+            ])
+    edit = StateTransition()
+
+    def default_start(self, fields):
+        year, month = int(self.record.year), int(self.record.month)
+        _, last_day = calendar.monthrange(year, month)
+        return {
+            'from_date': datetime.date(year, month, 1),
+            'to_date': datetime.date(year, month, last_day),
+            }
+
+    def transition_edit(self):
+        """
+        Apply the values to the matching day rows of the timesheet with one
+        write.
+        """
+        values = {'task': self.start.task}
+        if self.start.task == 'IN_PROJECT':
+            values['project'] = (
+                self.start.project.id if self.start.project else None)
+            values['detail'] = self.start.detail
+            for name in ['time_in', 'time_out']:
+                if getattr(self.start, name):
+                    values[name] = getattr(self.start, name)
+        weekdays = (
+            {int(w) for w in self.start.weekdays}
+            if self.start.weekdays else None)
+        records = self.record.edit_days(
+            [self.record], values, from_date=self.start.from_date,
+            to_date=self.start.to_date, weekdays=weekdays)
+        logger.info(
+            "Edited %s records of timesheet %s",
+            len(records), self.record.id)
+        return 'end'
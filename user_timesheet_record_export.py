@@ -0,0 +1,80 @@
+from trytond.model import ModelView, fields
+from trytond.wizard import Button, StateView, Wizard
+from trytond.pool import Pool
+from trytond.transaction import Transaction
+import datetime
+import tempfile
+
+class ExportStart(ModelView):
+    "Export Timesheet Records"
+    __name__ = 'afx.user.timesheet.record.export.start'
+
+    from_date = fields.Date("From Date", required=True)
+    to_date = fields.Date("To Date", required=True)
+    compress = fields.Boolean("Compress", help="Compress the file with gzip.")
+    include_archived = fields.Boolean(
+        "Include Archived", help="Include the archived months.")
+
+    # ------- DEFAULT VALUES --------
+    @classmethod
+    def default_from_date(cls):
+        # Default to the previous month
+        today = datetime.date.today()
+        return (today.replace(day=1) - datetime.timedelta(days=1)).replace(
+            day=1)
+
+    @classmethod
+    def default_to_date(cls):
+        today = datetime.date.today()
+        return today.replace(day=1) - datetime.timedelta(days=1)
+
+    @classmethod
+    def default_compress(cls):
+        return False
+
+
+class ExportResult(ModelView):
+    "Export Timesheet Records"
+    __name__ = 'afx.user.timesheet.record.export.result'
+
+    file = fields.Binary("File", readonly=True, filename='filename')
+    filename = fields.Char("File Name", readonly=True)
+
+
+class Export(Wizard):
+    "Export Timesheet Records"
+    __name__ = 'afx.user.timesheet.record.export'
+
+    start = StateView('afx.user.timesheet.record.export.start',
+        'afx_timesheet.user_timesheet_record_export_start_view_form', [
+            Button('Cancel', 'end', 'tryton-cancel'),
+            Button('Export', 'result', 'tryton-ok', default=True),
+            ])
+    result = StateView('afx.user.timesheet.record.export.result',
+        'afx_timesheet.user_timesheet_record_export_result_view_form', [
+            Button('Close', 'end', 'tryton-close', default=True),
+            ])
+
+    def default_result(self, fields):
+        """
+        Stream the records into a temporary file, the rows are never all
+        loaded in memory.
+        """
+        pool = Pool()
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+
+        filename = 'timesheet_%s_%s.csv' % (
+            self.start.from_date.strftime('%Y%m%d'),
+            self.start.to_date.strftime('%Y%m%d'))
+        if self.start.compress:
+            filename += '.gz'
+        with tempfile.TemporaryFile() as file, Transaction().set_context(
+                include_archived=self.start.include_archived):
+            UserTimesheetRecord.export_csv(
+                file, self.start.from_date, self.start.to_date,
+                compress=self.start.compress)
+            file.seek(0)
+            return {
+                'file': file.read(),
+                'filename': filename,
+                }
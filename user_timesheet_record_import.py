@@ -0,0 +1,180 @@
+from trytond.model import ModelView, fields
+from trytond.wizard import Button, StateTransition, StateView, Wizard
+from trytond.exceptions import UserError
+from trytond.pool import Pool
+import datetime
+import csv
+import io
+import logging
+
+logger = logging.getLogger(__name__)
+
+class ImportStart(ModelView):
+    "Import Timesheet Records"
+    __name__ = 'afx.user.timesheet.record.import.start'
+
+    file = fields.Binary("File", required=True,
+        help="CSV file with the columns: Date (YYYY-MM-DD), Status, "
+        "S/O Number, Detail, Time In (HH:MM) and Time Out (HH:MM).\n"
+        "The other columns of the export file are ignored.")
+
+
+class Import(Wizard):
+    "Import Timesheet Records"
+    __name__ = 'afx.user.timesheet.record.import'
+
+    start = StateView('afx.user.timesheet.record.import.start',
+        'afx_timesheet.user_timesheet_record_import_start_view_form', [
+            Button('Cancel', 'end', 'tryton-cancel'),
+            Button('Import', 'import_', 'tryton-ok', default=True),
+            ])
+    import_ = StateTransition()
+
+    def transition_import_(self):
+        """
+        Validate all the lines of the file in one pass then update the
+        matching day rows of the timesheet with one write.
+        """
+        pool = Pool()
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+
+        lines = self.parse(self.start.file)
+        to_write, errors = self.validate_lines(self.record, lines)
+        if errors:
+            raise UserError(
+                "Import Failed",
+                "\n".join(f"Line {n}: {msg}" for n, msg in errors))
+
+        # Store the days which are imported but not yet stored
+        dates = [d for d, r, _ in to_write if r is None]
+        materialized = {}
+        if dates:
+            materialized = dict(
+                zip(dates, self.record.materialize_days(dates)))
+        to_write = [
+            (r if r is not None else materialized[d], v)
+            for d, r, v in to_write]
+
+        # Group the rows sharing the same values into one write action
+        grouped = {}
+        for record, values in to_write:
+            key = tuple(sorted(values.items()))
+            grouped.setdefault(key, []).append(record)
+        args = []
+        for key, records in grouped.items():
+            args.extend((records, dict(key)))
+        if args:
+            UserTimesheetRecord.write(*args)
+        logger.info(
+            "Imported %s records into timesheet %s",
+            len(to_write), self.record.id)
+        return 'end'
+
+    @staticmethod
+    def parse(data):
+        """
+        Yield the (line number, row dictionary) of the CSV data.
+        The data is decoded line by line while it is read.
+        """
+        text = io.TextIOWrapper(
+            io.BytesIO(data), encoding='utf-8-sig', newline='')
+        # The header is line 1
+        yield from enumerate(csv.DictReader(text), 2)
+
+    @classmethod
+    def validate_lines(cls, timesheet, lines):
+        """
+        Return the (date, record, values) to write and the (line number,
+        message) errors of all the lines. The record is None for the days of
+        the month which are not yet stored: the default days of sparse
+        timesheets and the days off.
+        The lines are read in one pass, the day rows and the projects are
+        loaded with one query each.
+        """
+        pool = Pool()
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+        Project = pool.get('afx.project')
+
+        tasks = {code for code, _ in UserTimesheetRecord._task_get()}
+        records = {r.date: r for r in UserTimesheetRecord.search([
+                    ('timesheet', '=', timesheet.id),
+                    ])}
+        # The days which are not stored are stored when they are imported
+        records.update(dict.fromkeys(
+                set(timesheet.generate_dates_list(
+                        int(timesheet.year), int(timesheet.month)))
+                - set(records)))
+
+        # The projects are checked once all the S/O Numbers are read
+        checked, seen = [], {}
+        for n, row in lines:
+            line_errors = []
+            date = cls._parse_date(row.get('Date'))
+            record = None
+            if not date:
+                line_errors.append(f"Invalid date '{row.get('Date')}'.")
+            elif date in seen:
+                line_errors.append(
+                    f"Date {date} is already on line {seen[date]}.")
+            elif date not in records:
+                line_errors.append(f"Date {date} is not in the timesheet.")
+            else:
+                seen[date] = n
+                record = records[date]
+
+            task = (row.get('Status') or '').strip()
+            if task not in tasks:
+                line_errors.append(f"Unknown status '{task}'.")
+            values = {'task': task}
+            so_no = None
+            if task == 'IN_PROJECT':
+                so_no = (row.get('S/O Number') or '').strip()
+                if not so_no:
+                    line_errors.append("Missing S/O Number.")
+                values['detail'] = row.get('Detail') or None
+                for name, column in [
+                        ('time_in', 'Time In'), ('time_out', 'Time Out')]:
+                    value = (row.get(column) or '').strip()
+                    values[name] = cls._parse_time(value) if value else None
+                    if value and not values[name]:
+                        line_errors.append(f"Invalid {column} '{value}'.")
+                values['total'] = UserTimesheetRecord.compute_total_hours(
+                    values['time_in'], values['time_out'])
+            checked.append((n, date, record, values, so_no, line_errors))
+
+        so_nos = {c[4] for c in checked} - {None, ''}
+        projects = {}
+        if so_nos:
+            for project in Project.search([('so_no', 'in', list(so_nos))]):
+                projects.setdefault(project.so_no, project)
+
+        to_write, errors = [], []
+        for n, date, record, values, so_no, line_errors in checked:
+            if so_no and so_no not in projects:
+                line_errors.append(f"No project with S/O Number '{so_no}'.")
+            elif so_no:
+                values['project'] = projects[so_no].id
+                values['so_no'] = so_no
+            values = UserTimesheetRecord.clean_task_values(values)
+
+            if line_errors:
+                errors.extend((n, msg) for msg in line_errors)
+            else:
+                to_write.append((date, record, values))
+        return to_write, errors
+
+    @staticmethod
+    def _parse_date(value):
+        try:
+            return datetime.date.fromisoformat((value or '').strip())
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _parse_time(value):
+        for format_ in ['%H:%M', '%H:%M:%S']:
+            try:
+                return datetime.datetime.strptime(value, format_).time()
+            except ValueError:
+                continue
+        return None
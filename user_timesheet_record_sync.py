@@ -0,0 +1,153 @@
+from trytond.model import ModelSQL, ModelView, fields
+from trytond.pool import Pool
+from trytond.tools import grouped_slice
+from trytond.transaction import Transaction, without_check_access
+from sql.aggregate import Count, Min
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+class UserTimesheetRecordSync(ModelSQL, ModelView):
+    "Timesheet Record Project Sync Queue"
+    __name__ = 'afx.user.timesheet.record.sync'
+
+    # Hardcoded
+    BATCH_SIZE = 500
+    MAX_ATTEMPTS = 10
+
+    record = fields.Many2One(
+        'afx.user.timesheet.record', "Record", required=True, readonly=True,
+        ondelete='CASCADE')
+    attempts = fields.Integer("Attempts", readonly=True)
+    next_attempt_at = fields.Timestamp(
+        "Next Attempt at", readonly=True,
+        help="When the failed synchronisation will be retried.")
+    last_error = fields.Text("Last Error", readonly=True)
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        cls._order.insert(0, ('create_date', 'ASC'))
+
+    # ------- DEFAULT VALUES --------
+    @classmethod
+    def default_attempts(cls):
+        return 0
+
+    # -------- QUEUE METHODS --------
+    @classmethod
+    def enqueue(cls, records):
+        """
+        Queue the timesheet records for project synchronisation.
+        Records already waiting in the queue are not added again.
+        """
+        record_ids = {r.id for r in records}
+        if not record_ids:
+            return
+        with without_check_access():
+            queued = cls.search([
+                    ('record', 'in', list(record_ids)),
+                    ('attempts', '<', cls.MAX_ATTEMPTS),
+                    ])
+            record_ids -= {q.record.id for q in queued}
+            if record_ids:
+                cls.create([{'record': r} for r in sorted(record_ids)])
+
+    @classmethod
+    def process(cls):
+        """
+        Synchronise the queued records by batches, each batch in its own
+        transaction. When a batch fails, its records are retried one by one
+        so only the failing records are rescheduled.
+        The due entries are read once, so the entries rescheduled or added
+        during the run wait for the next one.
+        """
+        transaction = Transaction()
+        now = datetime.datetime.now()
+        entries = cls.search([
+                ('attempts', '<', cls.MAX_ATTEMPTS),
+                ['OR',
+                    ('next_attempt_at', '=', None),
+                    ('next_attempt_at', '<=', now),
+                    ],
+                ])
+        for entry_ids in grouped_slice(
+                [e.id for e in entries], cls.BATCH_SIZE):
+            entry_ids = list(entry_ids)
+            try:
+                with transaction.new_transaction() as new_transaction:
+                    cls._sync(entry_ids)
+                    new_transaction.commit()
+            except Exception:
+                logger.warning(
+                    "Project sync batch failed, retrying each record",
+                    exc_info=True)
+                for entry_id in entry_ids:
+                    try:
+                        with transaction.new_transaction() as new_transaction:
+                            cls._sync([entry_id])
+                            new_transaction.commit()
+                    except Exception as e:
+                        logger.error(
+                            "Project sync failed for queue entry %s: %s",
+                            entry_id, e)
+                        with transaction.new_transaction() as new_transaction:
+                            cls._reschedule(entry_id, e)
+                            new_transaction.commit()
+        logger.info("Project sync queue status: %s", cls.get_status())
+
+    @classmethod
+    def _sync(cls, entry_ids):
+        pool = Pool()
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+        # The entries may have been processed or deleted with their record
+        # since they were read
+        entries = cls.search([('id', 'in', entry_ids)])
+        records = list({e.record for e in entries})
+        # The synchronisation is idempotent so a record queued twice or
+        # retried after a partial failure ends up in the same state
+        UserTimesheetRecord.sync_project_tasks(records)
+        cls.delete(entries)
+
+    @classmethod
+    def _reschedule(cls, entry_id, error):
+        entries = cls.search([('id', '=', entry_id)])
+        if not entries:
+            return
+        entry, = entries
+        attempts = (entry.attempts or 0) + 1
+        # Exponential backoff capped to one day
+        delay = datetime.timedelta(minutes=min(2 ** attempts, 24 * 60))
+        cls.write([entry], {
+                'attempts': attempts,
+                'next_attempt_at': datetime.datetime.now() + delay,
+                'last_error': str(error),
+                })
+
+    @classmethod
+    def get_status(cls):
+        """
+        Return the depth of the queue, the number of entries which reached
+        the maximum attempts and the lag in seconds of the oldest entry.
+        """
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+        cursor.execute(*table.select(
+                Count(table.id), Min(table.create_date),
+                where=table.attempts < cls.MAX_ATTEMPTS))
+        depth, oldest = cursor.fetchone()
+        cursor.execute(*table.select(
+                Count(table.id),
+                where=table.attempts >= cls.MAX_ATTEMPTS))
+        failed, = cursor.fetchone()
+        lag = 0
+        if oldest:
+            if isinstance(oldest, str):
+                oldest = datetime.datetime.fromisoformat(oldest)
+            lag = (datetime.datetime.now() - oldest).total_seconds()
+        return {
+            'depth': depth,
+            'failed': failed,
+            'lag': lag,
+            }
@@ -0,0 +1,62 @@
+from trytond.model import Index, ModelSQL, ModelView, fields
+from trytond.pool import Pool
+from trytond.transaction import Transaction
+from trytond.tools import grouped_slice, reduce_ids
+from sql import Literal
+from sql.functions import CurrentTimestamp
+import datetime
+
+class UserTimesheetRecordTombstone(ModelSQL, ModelView):
+    "Timesheet Record Tombstone"
+    __name__ = 'afx.user.timesheet.record.tombstone'
+
+    # Hardcoded
+    RETENTION = datetime.timedelta(days=90)
+
+    record = fields.Integer("Record", readonly=True,
+        help="The id of the deleted record.")
+    unique_id = fields.Char("Uuid", size=32, readonly=True)
+    timesheet = fields.Integer("Timesheet", readonly=True)
+    date = fields.Date("Date", readonly=True)
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.add(
+            Index(t, (t.create_date, Index.Range()), (t.id, Index.Range())))
+        cls._order.insert(0, ('create_date', 'DESC'))
+
+    @classmethod
+    def bury(cls, record_ids):
+        """
+        Log the deletion of the timesheet records with one INSERT ... SELECT
+        per slice of ids.
+        """
+        pool = Pool()
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+        table = cls.__table__()
+        record = UserTimesheetRecord.__table__()
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+
+        for sub_ids in grouped_slice(record_ids):
+            cursor.execute(*table.insert(
+                    [table.record, table.unique_id, table.timesheet,
+                        table.date, table.create_uid, table.create_date],
+                    record.select(
+                        record.id, record.unique_id, record.timesheet,
+                        record.date, Literal(transaction.user),
+                        CurrentTimestamp(),
+                        where=reduce_ids(record.id, sub_ids))))
+
+    @classmethod
+    def purge(cls):
+        """
+        Delete the tombstones older than the retention period.
+        """
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+        cursor.execute(*table.delete(
+                where=table.create_date < (
+                    datetime.datetime.now() - cls.RETENTION)))
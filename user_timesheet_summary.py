@@ -0,0 +1,208 @@
+from trytond.model import ModelSQL, ModelView, fields
+from trytond.pool import Pool
+from trytond.transaction import Transaction
+from trytond.tools import grouped_slice, reduce_ids
+from trytond import backend
+from sql import Literal, Null, Values
+from sql.aggregate import Count, Sum
+from sql.conditionals import Coalesce
+from sql.functions import CurrentTimestamp
+from collections import defaultdict
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+class UserTimesheetSummary(ModelSQL, ModelView):
+    "User Timesheet Summary"
+    __name__ = 'afx.user.timesheet.summary'
+
+    timesheet = fields.Many2One(
+        'afx.user.timesheet', "Timesheet", required=True, readonly=True,
+        ondelete='CASCADE')
+    task = fields.Selection([], "Status", sort=False, readonly=True)
+    project = fields.Many2One('afx.project', "Project", readonly=True)
+    so_no = fields.Function(fields.Char("S/O Number"), 'get_so_no')
+    days = fields.Integer("Days", readonly=True)
+    hours = fields.Float("Hours", digits=(16, 2), readonly=True)
+
+    @classmethod
+    def __setup__(cls):
+        pool = Pool()
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+        super().__setup__()
+        cls.task.selection = UserTimesheetRecord._task_get()
+        cls._order.insert(0, ('task', 'ASC'))
+
+    @classmethod
+    def __register__(cls, module_name):
+        created = not backend.TableHandler.table_exist(cls._table)
+
+        super().__register__(module_name)
+
+        # Migration from 7.4: compute the summary of existing timesheets
+        if created:
+            cls.rebuild()
+
+    def get_so_no(self, name):
+        if self.project and self.project.so_no:
+            return self.project.so_no
+        return None
+
+    # -------- SUMMARY METHODS --------
+    @classmethod
+    def apply_deltas(cls, deltas):
+        """
+        Add the deltas to the summary and to the total hours of the
+        timesheets.
+        deltas is a dictionary of (hours, days) keyed by
+        (timesheet, task, project).
+        The lines are updated in SQL by a fixed number of queries for each
+        slice of timesheets, whatever the access of the user to the summary.
+        """
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+        table = cls.__table__()
+        timesheet = UserTimesheet.__table__()
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+
+        deltas = {k: v for k, v in deltas.items() if any(v)}
+        if not deltas:
+            return
+        by_timesheet = defaultdict(dict)
+        for key, value in deltas.items():
+            by_timesheet[key[0]][key] = value
+
+        for sub_ids in grouped_slice(list(by_timesheet)):
+            sub_ids = list(sub_ids)
+            existing = {}
+            cursor.execute(*table.select(
+                    table.id, table.timesheet, table.task, table.project,
+                    where=reduce_ids(table.timesheet, sub_ids)))
+            for id_, timesheet_id, task, project_id in cursor:
+                existing[(timesheet_id, task or '', project_id)] = id_
+
+            to_update, to_create = [], []
+            timesheet_hours = defaultdict(float)
+            for timesheet_id in sub_ids:
+                for key, (hours, days) in by_timesheet[timesheet_id].items():
+                    if key in existing:
+                        to_update.append([existing[key], hours, days])
+                    else:
+                        to_create.append([
+                                transaction.user, CurrentTimestamp(),
+                                *key, hours, days])
+                    timesheet_hours[timesheet_id] += hours
+
+            if to_update:
+                values = Values(to_update)
+                cursor.execute(*table.update(
+                        [table.hours, table.days],
+                        [Coalesce(table.hours, 0) + values.column2,
+                            Coalesce(table.days, 0) + values.column3],
+                        from_=[values],
+                        where=table.id == values.column1))
+            if to_create:
+                cursor.execute(*table.insert(
+                        [table.create_uid, table.create_date,
+                            table.timesheet, table.task, table.project,
+                            table.hours, table.days],
+                        Values(to_create)))
+            to_update = [[i, h] for i, h in timesheet_hours.items() if h]
+            if to_update:
+                values = Values(to_update)
+                cursor.execute(*timesheet.update(
+                        [timesheet.total_hours],
+                        [Coalesce(timesheet.total_hours, 0) + values.column2],
+                        from_=[values],
+                        where=timesheet.id == values.column1))
+            # Remove the lines no more used by any record
+            cursor.execute(*table.delete(
+                    where=reduce_ids(table.timesheet, sub_ids)
+                    & (table.days <= 0)))
+
+    @classmethod
+    def _get_default_deltas(cls, timesheet_ids):
+        """
+        Return the contributions of the default days which are not stored
+        of the sparse timesheets.
+        """
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+        record = UserTimesheetRecord.__table__()
+        cursor = Transaction().connection.cursor()
+
+        stored = defaultdict(set)
+        cursor.execute(*record.select(
+                record.timesheet, record.date,
+                where=reduce_ids(record.timesheet, timesheet_ids)))
+        for timesheet_id, date in cursor:
+            if isinstance(date, str):
+                date = datetime.date.fromisoformat(date)
+            stored[timesheet_id].add(date)
+        deltas = {}
+        for timesheet in UserTimesheet.browse(timesheet_ids):
+            deltas.update(timesheet.get_default_contributions(
+                    d for d in timesheet.get_dates()
+                    if d not in stored[timesheet.id]))
+        return deltas
+
+    @classmethod
+    def rebuild(cls, timesheet_ids=None):
+        """
+        Recompute from the records the summary and the total hours of the
+        timesheets, or of all timesheets if timesheet_ids is None.
+        """
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+        UserTimesheetRecord = pool.get('afx.user.timesheet.record')
+        table = cls.__table__()
+        timesheet = UserTimesheet.__table__()
+        record = UserTimesheetRecord.__table__()
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+
+        if timesheet_ids is None:
+            slices = [None]
+        else:
+            slices = grouped_slice(timesheet_ids)
+        for sub_ids in slices:
+            if sub_ids is None:
+                where = Literal(True)
+                record_where = record.timesheet != Null
+                timesheet_where = Literal(True)
+            else:
+                sub_ids = list(sub_ids)
+                where = reduce_ids(table.timesheet, sub_ids)
+                record_where = reduce_ids(record.timesheet, sub_ids)
+                timesheet_where = reduce_ids(timesheet.id, sub_ids)
+            cursor.execute(*table.delete(where=where))
+            task = Coalesce(record.task, '')
+            cursor.execute(*table.insert(
+                    [table.create_uid, table.create_date,
+                        table.timesheet, table.task, table.project,
+                        table.hours, table.days],
+                    record.select(
+                        Literal(transaction.user), CurrentTimestamp(),
+                        record.timesheet, task, record.project,
+                        Sum(Coalesce(record.total, 0)), Count(Literal('*')),
+                        where=record_where,
+                        group_by=[record.timesheet, task, record.project])))
+            cursor.execute(*timesheet.update(
+                    [timesheet.total_hours],
+                    [Coalesce(record.select(
+                                Sum(record.total),
+                                where=record.timesheet == timesheet.id),
+                            0)],
+                    where=timesheet_where))
+            # The default days of sparse timesheets are not stored
+            sparse_where = timesheet_where & (timesheet.sparse == Literal(True))
+            cursor.execute(*timesheet.select(timesheet.id, where=sparse_where))
+            sparse_ids = [i for i, in cursor]
+            for sub_sparse_ids in grouped_slice(sparse_ids):
+                cls.apply_deltas(
+                    cls._get_default_deltas(list(sub_sparse_ids)))
+        logger.info("Rebuilt the summary of timesheets %s",
+            'all' if timesheet_ids is None else timesheet_ids)
@@ -0,0 +1,192 @@
+from trytond.model import ModelSQL, Unique, fields
+from trytond.pool import Pool
+from trytond.transaction import Transaction, without_check_access
+from trytond.tools import grouped_slice
+from trytond import backend
+from sql import Literal
+from collections import defaultdict
+import calendar
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+class WorkingDay(ModelSQL):
+    "Timesheet Working Day"
+    __name__ = 'afx.timesheet.working_day'
+
+    company = fields.Many2One(
+        'company.company', "Company", required=True, ondelete='CASCADE')
+    date = fields.Date("Date", required=True)
+    time_in = fields.Time("Time In", required=True)
+    time_out = fields.Time("Time Out", required=True)
+    hours = fields.Float("Hours", digits=(16, 2), required=True)
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        t = cls.__table__()
+        # The unique index also serves the lookups by month
+        cls._sql_constraints += [
+            ('company_date_unique', Unique(t, t.company, t.date),
+                'afx_timesheet.msg_working_day_company_date_unique'),
+            ]
+        cls._order.insert(0, ('date', 'ASC'))
+
+    @classmethod
+    def __register__(cls, module_name):
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+        Employee = pool.get('company.employee')
+        timesheet = UserTimesheet.__table__()
+        employee = Employee.__table__()
+        cursor = Transaction().connection.cursor()
+        created = not backend.TableHandler.table_exist(cls._table)
+
+        super().__register__(module_name)
+
+        # Migration from 7.4: freeze the calendar of the existing months
+        if created:
+            cursor.execute(*timesheet.join(
+                    employee, condition=timesheet.user == employee.id
+                    ).select(
+                    employee.company, timesheet.year, timesheet.month,
+                    group_by=[
+                        employee.company, timesheet.year, timesheet.month]))
+            cls.freeze(list(cursor))
+
+    @classmethod
+    def get_calendar(cls, company_id, year, month):
+        """
+        Return the frozen working dates of the month and the hours per work
+        day of the company or None if the month is not frozen.
+        """
+        _, last_day = calendar.monthrange(year, month)
+        days = cls.search([
+                ('company', '=', company_id),
+                ('date', '>=', datetime.date(year, month, 1)),
+                ('date', '<=', datetime.date(year, month, last_day)),
+                ])
+        if not days:
+            return None
+        return tuple(d.date for d in days), days[0].hours
+
+    @classmethod
+    def freeze(cls, months):
+        """
+        Store the working calendar of the (company, year, month) which are
+        not yet frozen, so the months in use keep the calendar of their
+        first timesheet until it is refrozen.
+        """
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+
+        months = {(c, int(y), int(m)) for c, y, m in months}
+        by_company = defaultdict(list)
+        for company_id, year, month in months:
+            by_company[company_id].append((year, month))
+
+        to_create = []
+        with without_check_access():
+            for company_id, company_months in by_company.items():
+                first_year, first_month = min(company_months)
+                last_year, last_month = max(company_months)
+                _, last_day = calendar.monthrange(last_year, last_month)
+                frozen = {
+                    (d.date.year, d.date.month) for d in cls.search([
+                            ('company', '=', company_id),
+                            ('date', '>=', datetime.date(
+                                    first_year, first_month, 1)),
+                            ('date', '<=', datetime.date(
+                                    last_year, last_month, last_day)),
+                            ])}
+                for year, month in company_months:
+                    if (year, month) in frozen:
+                        continue
+                    dates, hours = UserTimesheet.compute_working_calendar(
+                        company_id, year, month)
+                    # The default day of the sparse timesheets
+                    time_out = (
+                        datetime.datetime.combine(
+                            datetime.date.min, UserTimesheet.DAY_START)
+                        + datetime.timedelta(hours=hours)).time()
+                    to_create.extend({
+                            'company': company_id,
+                            'date': date,
+                            'time_in': UserTimesheet.DAY_START,
+                            'time_out': time_out,
+                            'hours': hours,
+                            } for date in dates)
+            if to_create:
+                cls.create(to_create)
+                UserTimesheet._working_calendar_cache.clear()
+                logger.info("Froze %s working days", len(to_create))
+
+    @classmethod
+    def get_open_months(cls, company_ids):
+        """
+        Return the (company, year, month) of the companies which have active
+        timesheets not closed.
+        """
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+        Employee = pool.get('company.employee')
+        timesheet = UserTimesheet.__table__()
+        employee = Employee.__table__()
+        cursor = Transaction().connection.cursor()
+
+        months = set()
+        for sub_ids in grouped_slice(list(company_ids)):
+            cursor.execute(*timesheet.join(
+                    employee, condition=timesheet.user == employee.id
+                    ).select(
+                    employee.company, timesheet.year, timesheet.month,
+                    where=employee.company.in_(list(sub_ids))
+                    & (timesheet.active == Literal(True))
+                    & (timesheet.state != 'closed'),
+                    group_by=[
+                        employee.company, timesheet.year, timesheet.month]))
+            months.update((c, int(y), int(m)) for c, y, m in cursor)
+        return months
+
+    @classmethod
+    def refreeze(cls, months):
+        """
+        Freeze again the working calendar of the (company, year, month) which
+        have open timesheets and rebuild the summary of their sparse
+        timesheets, after a change of the holidays or of the working time.
+        The months with only closed or archived timesheets keep their
+        calendar.
+        """
+        pool = Pool()
+        UserTimesheet = pool.get('afx.user.timesheet')
+        UserTimesheetSummary = pool.get('afx.user.timesheet.summary')
+
+        months = {(c, int(y), int(m)) for c, y, m in months}
+        months &= cls.get_open_months({c for c, _, _ in months})
+        if not months:
+            return
+        with without_check_access():
+            for company_id, year, month in months:
+                _, last_day = calendar.monthrange(year, month)
+                cls.delete(cls.search([
+                            ('company', '=', company_id),
+                            ('date', '>=', datetime.date(year, month, 1)),
+                            ('date', '<=', datetime.date(
+                                    year, month, last_day)),
+                            ]))
+            UserTimesheet._working_calendar_cache.clear()
+            cls.freeze(months)
+
+            timesheets = []
+            for company_id, year, month in months:
+                timesheets.extend(UserTimesheet.search([
+                            ('user.company', '=', company_id),
+                            ('year', '=', str(year)),
+                            ('month', '=', str(month)),
+                            ('sparse', '=', True),
+                            ('state', '!=', 'closed'),
+                            ]))
+        if timesheets:
+            UserTimesheetSummary.rebuild([t.id for t in timesheets])
+        logger.info("Refroze the working days of %s months", len(months))